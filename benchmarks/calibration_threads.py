@@ -0,0 +1,76 @@
+# Throughput of spatialnde2_cpp_calibration_function.calibration_function
+# versus the number of CPU cores it may use (row band tiling).
+#
+#   python benchmarks/calibration_threads.py --resolutions 1920x1080,3840x2160 --threads 1,2,4,8
+
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+import spatialnde2 as snde
+
+from spatialnde2_cpp_calibration_function import calibration_function, set_calibration_threads
+
+from common import setup_recdb, synthetic_calibration, publish_calibration, publish_frame, parse_resolutions
+
+
+def run(recdb, framechan, resolution, nframes):
+    (rows, cols) = resolution
+    frame = np.random.default_rng(0).integers(0, 65536, size=(rows, cols), dtype=np.uint16)
+
+    # Warm up: first frame of a new shape builds the undistortion maps
+    publish_frame(recdb, framechan, snde.SNDE_RTN_UINT16, frame).wait_complete()
+
+    start = time.perf_counter()
+    for cnt in range(nframes):
+        publish_frame(recdb, framechan, snde.SNDE_RTN_UINT16, frame).wait_complete()
+    elapsed = time.perf_counter() - start
+    return nframes / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="calibration_function throughput versus thread count")
+    parser.add_argument("--resolutions", default="1920x1080,2592x1944,3840x2160", help="Comma separated WIDTHxHEIGHT list")
+    parser.add_argument("--threads", default=None, help="Comma separated thread counts (default: powers of two up to the CPU count)")
+    parser.add_argument("--frames", type=int, default=50, help="Frames timed per measurement")
+    parser.add_argument("--crop", action="store_true", help="Benchmark with crop enabled")
+    args = parser.parse_args()
+
+    ncpus = multiprocessing.cpu_count()
+    if args.threads is None:
+        threadcounts = [1]
+        while threadcounts[-1] * 2 <= ncpus:
+            threadcounts.append(threadcounts[-1] * 2)
+    else:
+        threadcounts = [int(n) for n in args.threads.split(",")]
+
+    recdb = setup_recdb(ncpus)
+
+    transact = recdb.start_transaction()
+    framechan = recdb.define_channel("/bench/frame", "main", recdb.raw())
+    calibchan = recdb.define_channel("/bench/calib", "main", recdb.raw())
+    calibfunc = calibration_function.instantiate(
+        [snde.math_parameter_recording("/bench/frame"),
+        snde.math_parameter_recording("/bench/calib"),
+        snde.math_parameter_bool_const(args.crop)],
+        [snde.shared_string("calibimg")], "/bench/", False, False, False,
+        snde.math_definition("Benchmark calibration_function"), None)
+    recdb.add_math_function(calibfunc, False)
+    transact.end_transaction()
+
+    print("%12s %8s %10s %8s" % ("resolution", "threads", "fps", "speedup"))
+    for resolution in parse_resolutions(args.resolutions):
+        publish_calibration(recdb, calibchan, *synthetic_calibration(*resolution))
+        basefps = None
+        for nthreads in threadcounts:
+            set_calibration_threads(nthreads)
+            fps = run(recdb, framechan, resolution, args.frames)
+            if basefps is None:
+                basefps = fps
+            print("%12s %8d %10.1f %8.2f" % ("%dx%d" % (resolution[1], resolution[0]), nthreads, fps, fps / basefps))
+
+
+if __name__ == "__main__":
+    main()
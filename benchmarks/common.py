@@ -0,0 +1,82 @@
+import multiprocessing
+
+import numpy as np
+
+import spatialnde2 as snde
+
+
+def setup_recdb(ncpus=None):
+    # Standalone recording database (no dataguzzler-python required)
+    if ncpus is None:
+        ncpus = multiprocessing.cpu_count()
+    recdb = snde.recdatabase()
+    snde.setup_cpu(recdb, [], ncpus)
+    snde.setup_storage_manager(recdb)
+    snde.setup_math_functions(recdb, [])
+    recdb.startup()
+    return recdb
+
+
+def synthetic_calibration(rows, cols, k1=-0.25, k2=0.08):
+    # Camera matrix and distortion coefficients for a moderately
+    # barrel-distorted lens covering the frame, in the same form
+    # OpenCVCalibration publishes
+    focal = 0.8 * max(rows, cols)
+    mtx = np.array([[focal, 0, cols/2], [0, focal, rows/2], [0, 0, 1]], dtype=np.float32)
+    dist = np.array([k1, k2, 0, 0, 0], dtype=np.float32)
+    return mtx, dist, mtx.copy(), np.array([0, 0, -1, -1], dtype=np.int32)
+
+
+def publish_calibration(recdb, chanptr, mtx, dist, newmtx, roi, brightfield=None, darkfield=None):
+    # Same layout as OpenCVCalibration.SetCalibration
+    if brightfield is None:
+        brightfield = np.zeros((3, 3), dtype=np.uint16) + 65535
+    if darkfield is None:
+        darkfield = np.zeros((3, 3), dtype=np.uint16)
+
+    transact = recdb.start_transaction()
+    rec = snde.create_multi_ndarray_recording(recdb, chanptr, recdb.raw(), 6)
+    rec.define_array(0, snde.SNDE_RTN_UINT16, "brightfield")
+    rec.define_array(1, snde.SNDE_RTN_UINT16, "darkfield")
+    rec.define_array(2, snde.SNDE_RTN_FLOAT32, "cam_mtx")
+    rec.define_array(3, snde.SNDE_RTN_FLOAT32, "cam_dist")
+    rec.define_array(4, snde.SNDE_RTN_FLOAT32, "cam_newmtx")
+    rec.define_array(5, snde.SNDE_RTN_INT32, "cam_roi")
+    globalrev = recdb.end_transaction(transact)
+    rec.allocate_storage("brightfield", brightfield.shape)
+    rec.allocate_storage("darkfield", darkfield.shape)
+    rec.allocate_storage("cam_mtx", mtx.shape)
+    rec.allocate_storage("cam_dist", dist.shape)
+    rec.allocate_storage("cam_newmtx", newmtx.shape)
+    rec.allocate_storage("cam_roi", roi.shape)
+    rec.metadata = snde.immutable_metadata()
+    rec.mark_metadata_done()
+    rec.reference_ndarray('brightfield').data()[:] = brightfield
+    rec.reference_ndarray('darkfield').data()[:] = darkfield
+    rec.reference_ndarray('cam_mtx').data()[:] = mtx
+    rec.reference_ndarray('cam_dist').data()[:] = dist
+    rec.reference_ndarray('cam_newmtx').data()[:] = newmtx
+    rec.reference_ndarray('cam_roi').data()[:] = roi
+    rec.mark_data_ready()
+    globalrev.wait_complete()
+
+
+def publish_frame(recdb, chanptr, typenum, frame):
+    transact = recdb.start_transaction()
+    rec = snde.create_ndarray_ref(recdb, chanptr, recdb.raw(), typenum)
+    globalrev = recdb.end_transaction(transact)
+    rec.rec.metadata = snde.immutable_metadata()
+    rec.rec.mark_metadata_done()
+    rec.allocate_storage(frame.shape)
+    rec.data()[:] = frame
+    rec.rec.mark_data_ready()
+    return globalrev
+
+
+def parse_resolutions(text):
+    # "1920x1080,3840x2160" -> [(1080, 1920), (2160, 3840)] as (rows, cols)
+    resolutions = []
+    for item in text.split(","):
+        (width, height) = item.lower().split("x")
+        resolutions.append((int(height), int(width)))
+    return resolutions
@@ -1,5 +1,11 @@
 from . import camera
 from . import calibration
+from . import cameragroup
+from . import sources
 
 Camera = camera.OpenCVCamera
-Calibration = calibration.OpenCVCalibration
\ No newline at end of file
+Calibration = calibration.OpenCVCalibration
+CameraGroup = cameragroup.OpenCVCameraGroup
+LiveSource = sources.LiveSource
+SyntheticSource = sources.SyntheticSource
+FileSource = sources.FileSource
\ No newline at end of file
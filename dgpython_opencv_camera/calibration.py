@@ -1,6 +1,12 @@
+import os
+import os.path
+import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from dataguzzler_python.dgpy import Module as dgpy_Module
+from dataguzzler_python.dgpy import InitCompatibleThread
 
 import spatialnde2 as snde
 
@@ -11,14 +17,197 @@ from typing import ClassVar
 
 from matplotlib import pyplot as plt
 
+from .camera import frame_valid
+
+
+def gray8(img, out=None):
+    # Converts a camera frame to the 8-bit grayscale image the checkerboard
+    # detector needs in a single pass with no float temporaries, writing into
+    # out when it is a uint8 array of the right shape (otherwise a new array
+    # is allocated). Returns the grayscale image, or None for unsupported types.
+    shape = img.shape[:2]
+    if out is None or out.shape != shape or out.dtype != np.uint8:
+        out = np.empty(shape, dtype=np.uint8)
+
+    if img.dtype.fields is not None and all(elem in img.dtype.fields for elem in ['r','g','b']):
+        # Packed 8-bit RGBA, e.g. from snde.numpy_bgrtorgba
+        offsets = tuple(img.dtype.fields[elem][1] for elem in ['r','g','b'])
+        if img.dtype.itemsize != 4 or any(img.dtype.fields[elem][0] != np.uint8 for elem in ['r','g','b']):
+            return None
+        if offsets == (0, 1, 2):
+            code = cv2.COLOR_RGBA2GRAY
+        elif offsets == (2, 1, 0):
+            code = cv2.COLOR_BGRA2GRAY
+        else:
+            return None
+        channels = np.ascontiguousarray(img).view(np.uint8).reshape(shape + (4,))
+        return cv2.cvtColor(channels, code, dst=out)
+    elif img.dtype == np.uint8 and len(img.shape) == 3 and img.shape[2] == 3:
+        # BGR from OpenCVCamera
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=out)
+    elif img.dtype == np.uint8 and len(img.shape) == 3 and img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY, dst=out)
+    elif img.dtype == np.uint8 and len(img.shape) == 2:
+        np.copyto(out, img)
+        return out
+    elif img.dtype == np.uint16 and len(img.shape) == 2:
+        # 16-bit gray, e.g. from snde.numpy_bgrtogray16 or averaging
+        return cv2.convertScaleAbs(img, dst=out, alpha=1/256)
+    elif img.dtype in (np.float32, np.float64) and len(img.shape) == 2:
+        # Floating point gray has no fixed range, so stretch it
+        return cv2.normalize(img, out, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    else:
+        return None
+
+
+def save_replacing(filename, save, *args, **kwargs):
+    # Writes filename with save (e.g. np.save) under a temporary name and
+    # then renames it over filename, so a failed save never leaves a half
+    # written file behind
+    tmpname = filename + ".tmp"
+    try:
+        with open(tmpname, "wb") as fh:
+            save(fh, *args, **kwargs)
+        os.replace(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+
+def find_checkerboard_corners(img8, boardsize, imgprocess=True, pyramidlevels=0, fastcheck=False):
+    # Returns the subpixel-refined corners, or None if the board was not found.
+    # imgprocess selects OpenCV's default adaptive threshold and normalization;
+    # without it a plain global threshold is used, which is faster but less robust.
+    # With pyramidlevels > 0 the board is searched for on an image downscaled
+    # by 2**pyramidlevels and the corners are scaled up and refined on the
+    # full resolution image. fastcheck rejects frames without a board quickly.
+    # OpenCV releases the GIL, so this can run on a thread pool.
+    search = img8
+    for level in range(pyramidlevels):
+        search = cv2.pyrDown(search)
+
+    flags = 0
+    if imgprocess:
+        flags += cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
+    if fastcheck:
+        flags += cv2.CALIB_CB_FAST_CHECK
+    ret, corners = cv2.findChessboardCorners(search, boardsize, flags=flags)
+
+    if ret == False:
+        return None
+
+    # pyrDown centers dst(x) on src(2x), so coordinates just scale. The
+    # downscaled search is good to about a pixel at its own scale, so the
+    # refinement window grows by that many full resolution pixels.
+    scale = 2 ** pyramidlevels
+    corners = corners * scale
+    halfwin = 10 + scale
+
+    return cv2.cornerSubPix(img8, corners, (halfwin,halfwin), (-1,-1), (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001))
+
+
+def is_duplicate_pose(corners, imgpoints, mindisplacement):
+    # imgpoints is a (views, points, 1, 2) array of stored corners of the
+    # same board. The detector may number the corners from either end of
+    # the board, so compare against both orderings
+    if len(imgpoints) == 0 or imgpoints.shape[1:] != corners.shape:
+        return False
+    displacement = np.minimum(np.linalg.norm(imgpoints - corners, axis=-1).mean(axis=(1,2)),
+                              np.linalg.norm(imgpoints[:,::-1] - corners, axis=-1).mean(axis=(1,2)))
+    return bool((displacement < mindisplacement).any())
+
+
+def calibration_cache_path(cachedir, cameraid, frameshape):
+    # Directory holding the saved calibration of a camera at a resolution
+    return os.path.join(cachedir, "%s_%dx%d" % (re.sub(r'[^A-Za-z0-9_.-]', '_', cameraid), frameshape[1], frameshape[0]))
+
+
+class PoseSet(object):
+    # Stored checkerboard views, grouped by board geometry (nchkw, nchkh).
+    # Each geometry has a single object point template shared by all its
+    # views and one contiguous corner array, grown by doubling, so the
+    # solver gets views into it rather than hundreds of small arrays.
+    _boards = None
+
+    def __init__(self):
+        self._boards = {}
+
+    def add(self, boardsize, corners):
+        if boardsize not in self._boards:
+            (nchkw, nchkh) = boardsize
+            template = np.zeros((nchkw * nchkh, 3), np.float32)
+            template[:,:2] = np.mgrid[0:nchkw, 0:nchkh].T.reshape(-1,2)
+            self._boards[boardsize] = [template, np.empty((16,) + corners.shape, dtype=np.float32), 0]
+        board = self._boards[boardsize]
+        (template, allcorners, count) = board
+        if count == allcorners.shape[0]:
+            grown = np.empty((2 * count,) + allcorners.shape[1:], dtype=np.float32)
+            grown[:count] = allcorners
+            board[1] = allcorners = grown
+        allcorners[count] = corners
+        board[2] = count + 1
+
+    def corners(self, boardsize):
+        # Stored corners of one geometry, as a (views, points, 1, 2) array
+        if boardsize not in self._boards:
+            return np.empty((0,), dtype=np.float32)
+        (template, allcorners, count) = self._boards[boardsize]
+        return allcorners[:count]
+
+    def views(self):
+        # (objpoints, imgpoints) lists for cv2.calibrateCamera. Entries are
+        # views, and stay valid if more views are added or select() is called.
+        objpoints = []
+        imgpoints = []
+        for (template, allcorners, count) in self._boards.values():
+            objpoints.extend([template] * count)
+            imgpoints.extend(allcorners[:count])
+        return (objpoints, imgpoints)
+
+    def select(self, keep):
+        # Keeps the views where keep is True, in the order of views()
+        start = 0
+        for boardsize in list(self._boards):
+            (template, allcorners, count) = self._boards[boardsize]
+            kept = allcorners[:count][keep[start:start + count]]
+            start += count
+            if kept.shape[0] == 0:
+                del self._boards[boardsize]
+                continue
+            self._boards[boardsize] = [template, kept, kept.shape[0]]
+
+    def clear(self):
+        self._boards = {}
+
+    def export(self):
+        # Dictionary of arrays for np.savez
+        arrays = {}
+        for (index, boardsize) in enumerate(self._boards):
+            arrays["board%d" % (index)] = np.array(boardsize)
+            arrays["corners%d" % (index)] = self.corners(boardsize)
+        return arrays
+
+    def load(self, arrays):
+        index = 0
+        while "board%d" % (index) in arrays:
+            boardsize = tuple(int(n) for n in arrays["board%d" % (index)])
+            for corners in arrays["corners%d" % (index)]:
+                self.add(boardsize, corners)
+            index += 1
+
+    def __len__(self):
+        return sum(count for (template, allcorners, count) in self._boards.values())
+
+    pass
+
 
 class OpenCVCalibration(object, metaclass=dgpy_Module):
     recdb: ClassVar[snde.recdatabase] = None
     chanptr = None
     rec: ClassVar[snde.multi_ndarray_recording] = None
     camchannel: str = None
-    objpoints: list = None
-    imgpoints: list = None
+    poses: PoseSet = None
     checkershape = None
     brightfield = None
     darkfield = None
@@ -26,13 +215,23 @@ class OpenCVCalibration(object, metaclass=dgpy_Module):
     dist = None
     newmtx = None
     roi = None
-
-    def __init__(self, module_name: str, recdb: snde.recdatabase, camchannel: str, nchkw: int, nchkh: int):
+    cachedir: str = None
+    cameraid: str = None
+    frameshape = None
+    rmserror = None
+    viewerrors = None
+    _solvedshape = None
+    _solver = None
+    _gray8buf = None
+
+    def __init__(self, module_name: str, recdb: snde.recdatabase, camchannel: str, nchkw: int, nchkh: int, cachedir: str = None, cameraid: str = None, frameshape=None):
+        # With cachedir, calibrations saved by SaveCalibration() are kept per
+        # camera (cameraid, by default camchannel) and frame shape (rows, cols),
+        # and a matching one is loaded at startup when frameshape is given.
         self.module_name = module_name
         self.recdb = recdb
         self.camchannel = camchannel
-        self.objpoints = []
-        self.imgpoints = []
+        self.poses = PoseSet()
         self.checkershape = None
         self.nchkw = nchkw
         self.nchkh = nchkh
@@ -53,6 +252,15 @@ class OpenCVCalibration(object, metaclass=dgpy_Module):
         self.dist = np.array([0,0,0,0,0], dtype=np.float32)
         self.roi = np.array([0,0,-1,-1], dtype=np.int32)
 
+        self.cachedir = cachedir
+        if cameraid is None:
+            cameraid = camchannel
+        self.cameraid = cameraid
+        self.frameshape = None
+        if frameshape is not None:
+            self.frameshape = tuple(frameshape[:2])
+            if cachedir is not None and os.path.exists(os.path.join(calibration_cache_path(cachedir, cameraid, self.frameshape), "calibration.npz")):
+                self.LoadCalibration(setcalibration=False)
 
         transact = self.recdb.start_transaction()
         self.chanptr = self.recdb.define_channel(self.module_name, "main", self.recdb.raw())
@@ -108,128 +316,288 @@ class OpenCVCalibration(object, metaclass=dgpy_Module):
             return False
 
 
-    def CaptureBrightfieldImage(self):
-        mon: snde.monitor_globalrevs = self.recdb.start_monitoring_globalrevs()
-        try:            
-            rev: snde.globalrevision = mon.wait_next(self.recdb)
-        finally:
-            mon.close(self.recdb)
-
-        rec = rev.get_ndarray_ref(self.camchannel)
-        self.brightfield = rec.data()
+    def _CalibrationShape(self):
+        # Frame shape the calibration is for, which keys the cache
+        if self.checkershape is not None:
+            return tuple(self.checkershape)
+        if self.frameshape is not None:
+            return tuple(self.frameshape)
+        return tuple(self.brightfield.shape[:2])
+
+    def _CalibrationPath(self, path):
+        if path is not None:
+            return path
+        if self.cachedir is None:
+            raise Exception("Must specify a path or a cache directory")
+        return calibration_cache_path(self.cachedir, self.cameraid, self._CalibrationShape())
+
+    def SaveCalibration(self, path=None):
+        # Saves the calibration to directory path, by default the cache entry
+        # for this camera and frame shape. The small arrays go in
+        # calibration.npz and the bright/dark fields in separate .npy files.
+        # Every file is written under a temporary name and renamed into place.
+        path = self._CalibrationPath(path)
+        os.makedirs(path, exist_ok=True)
+        save_replacing(os.path.join(path, "brightfield.npy"), np.save, self.brightfield)
+        save_replacing(os.path.join(path, "darkfield.npy"), np.save, self.darkfield)
+        # Written last, so an interrupted save is not picked up as a cache entry
+        save_replacing(os.path.join(path, "calibration.npz"), np.savez, mtx=self.mtx, dist=self.dist, newmtx=self.newmtx, roi=self.roi, cameraid=self.cameraid, frameshape=np.array(self._CalibrationShape()))
+        return path
+
+    def LoadCalibration(self, path=None, setcalibration=True):
+        # Loads a calibration saved by SaveCalibration, by default the cache
+        # entry for this camera and frame shape, and publishes it unless
+        # setcalibration is False. A cache entry is only used if the camera
+        # id and frame shape stored in it match.
+        fromcache = path is None
+        path = self._CalibrationPath(path)
+        calibfile = os.path.join(path, "calibration.npz")
+        if not os.path.exists(calibfile):
+            print("No Saved Calibration in %s" % (path))
+            return False
+        with np.load(calibfile) as calib:
+            frameshape = tuple(int(n) for n in calib["frameshape"])
+            cameraid = str(calib["cameraid"])
+            if fromcache and (cameraid != self.cameraid or frameshape != self._CalibrationShape()):
+                print("Saved Calibration in %s is for camera %s at %s, not %s at %s" % (path, cameraid, str(frameshape), self.cameraid, str(self._CalibrationShape())))
+                return False
+            self.mtx = calib["mtx"]
+            self.dist = calib["dist"]
+            self.newmtx = calib["newmtx"]
+            self.roi = calib["roi"]
+        # Read into memory: a mapped file could not be saved over later
+        self.brightfield = np.array(np.load(os.path.join(path, "brightfield.npy")))
+        self.darkfield = np.array(np.load(os.path.join(path, "darkfield.npy")))
+        # Stored views of another frame shape no longer apply, and the
+        # loaded solution is the incremental starting point for this one
+        self._CheckShape(frameshape)
+        self._solvedshape = frameshape
+        if setcalibration:
+            return self.SetCalibration()
         return True
 
-    def CaptureDarkfieldImage(self):
+    def _NextFrame(self):
+        # The camera channel of the next globalrev with a valid frame
         mon: snde.monitor_globalrevs = self.recdb.start_monitoring_globalrevs()
-        try:            
-            rev: snde.globalrevision = mon.wait_next(self.recdb)
+        try:
+            while True:
+                rev: snde.globalrevision = mon.wait_next(self.recdb)
+                rec = rev.get_ndarray_ref(self.camchannel)
+                if frame_valid(rec):
+                    return rec
         finally:
             mon.close(self.recdb)
 
-        rec = rev.get_ndarray_ref(self.camchannel)
-        self.darkfield = rec.data()
+    def CaptureBrightfieldImage(self):
+        rec = self._NextFrame()
+        self.brightfield = rec.data().copy()
         return True
 
-    def ProcessCameraCalibration(self):
-        if len(self.objpoints) == 0 or len(self.imgpoints) == 0:
-            print("Must capture checkerboard images first")
-            return False
-
-        mon: snde.monitor_globalrevs = self.recdb.start_monitoring_globalrevs()
-        try:            
-            rev: snde.globalrevision = mon.wait_next(self.recdb)
-        finally:
-            mon.close(self.recdb)
+    def CaptureDarkfieldImage(self):
+        rec = self._NextFrame()
+        self.darkfield = rec.data().copy()
+        return True
 
-        rec = rev.get_ndarray_ref(self.camchannel)
+    def _SolveCalibration(self, objpoints, imgpoints, checkershape, incremental):
+        flags = 0
+        mtx = None
+        dist = None
+        if incremental and self._solvedshape == checkershape:
+            # Start from the previous solution, which is already close
+            flags = cv2.CALIB_USE_INTRINSIC_GUESS
+            mtx = np.array(self.mtx, dtype=np.float64)
+            dist = np.array(self.dist, dtype=np.float64).ravel()
 
-        ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(self.objpoints, self.imgpoints, self.checkershape[::-1], None, None)
+        ret, mtx, dist, rvecs, tvecs, stdintrinsics, stdextrinsics, viewerrors = cv2.calibrateCameraExtended(objpoints, imgpoints, checkershape[::-1], mtx, dist, flags=flags)
 
         if ret:
-            newmtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (self.checkershape[1], self.checkershape[0]), 1, (self.checkershape[1], self.checkershape[0]))
+            newmtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (checkershape[1], checkershape[0]), 1, (checkershape[1], checkershape[0]))
             self.newmtx = newmtx
             self.mtx = mtx
             self.dist = dist
             self.roi = np.array(roi)
+            self.rmserror = ret
+            self.viewerrors = viewerrors.ravel()
+            self._solvedshape = checkershape
             return True
         else:
             print("Calibration Failed")
             return False
 
-    def CaptureCheckerboardImage(self, nchkw = None, nchkh = None, imgprocess=False, plot=True):
-        if nchkw is None and self.nchkw is not None:
+    def ProcessCameraCalibration(self, incremental=False, background=False):
+        # With incremental, the previous solution for this frame shape is the
+        # initial guess, so adding a few views to a large set converges in a
+        # few iterations. The RMS and per-view reprojection errors (pixels)
+        # of the solve are left in rmserror and viewerrors; see DropOutlierViews.
+        # With background, the solve runs on a worker thread and a
+        # concurrent.futures.Future of the result is returned immediately.
+        if len(self.poses) == 0:
+            print("Must capture checkerboard images first")
+            return False
+
+        # Snapshot, so capturing more views during a background solve is safe
+        args = self.poses.views() + (self.checkershape, incremental)
+        if not background:
+            return self._SolveCalibration(*args)
+
+        if self._solver is None:
+            self._solver = ThreadPoolExecutor(max_workers=1, initializer=InitCompatibleThread, initargs=(self, "_solverthread"))
+        return self._solver.submit(self._SolveCalibration, *args)
+
+    def DropOutlierViews(self, maxerror=None, nsigma=3.0):
+        # Removes the views whose reprojection error in the last solve is
+        # above maxerror pixels, by default nsigma standard deviations above
+        # the mean. Returns the number of views dropped; rerun
+        # ProcessCameraCalibration(incremental=True) afterwards.
+        if self.viewerrors is None or len(self.viewerrors) != len(self.poses):
+            print("Must run ProcessCameraCalibration on the current views first")
+            return None
+        if maxerror is None:
+            maxerror = self.viewerrors.mean() + nsigma * self.viewerrors.std()
+        keep = self.viewerrors <= maxerror
+        self.poses.select(keep)
+        self.viewerrors = self.viewerrors[keep]
+        return int(np.count_nonzero(~keep))
+
+    def _BoardSize(self, nchkw, nchkh):
+        if nchkw is None:
+            if self.nchkw is None:
+                raise Exception("Must specify checkerboard width")
             nchkw = self.nchkw
-        else:
-            raise Exception("Must specify checkerboard width")
-        if nchkh is None and self.nchkh is not None:
+        if nchkh is None:
+            if self.nchkh is None:
+                raise Exception("Must specify checkerboard height")
             nchkh = self.nchkh
+        return (nchkw, nchkh)
+
+    def _CheckShape(self, shape):
+        if self.checkershape is not None:
+            if self.checkershape != shape:
+                print("Image Shape Has Changed -- Clearing Old Images")
+                self.poses.clear()
+                self.viewerrors = None
+                self.checkershape = shape
         else:
-            raise Exception("Must specify checkerboard height")
+            self.checkershape = shape
 
-        mon: snde.monitor_globalrevs = self.recdb.start_monitoring_globalrevs()
-        try:            
-            rev: snde.globalrevision = mon.wait_next(self.recdb)
-        finally:
-            mon.close(self.recdb)
+    def _StorePose(self, boardsize, corners):
+        self.poses.add(boardsize, corners)
 
-        rec = rev.get_ndarray_ref(self.camchannel)
-        img = rec.data()
-
-        if img.dtype.fields != None and all(elem in img.dtype.fields for elem in ['r','g','b']):
-            # Type is RGB, we'll convert to 8-bit gray
-            img8 = (img['r'] * 0.299 + img['g'] * 0.587 + img['b'] * 0.114).astype('uint8')
-        elif img.dtype == np.uint16:
-            # Type is uint16 gray, we'll convert to 8-bit gray
-            img8 = (img/256).astype('uint8')
-        elif img.dtype == np.uint8 and len(img.shape) == 3:
-            # Type is probably BGR from OpenCV, we'll convert to 8-bit gray
-            img8 = (img[:,:,2] * 0.299 + img[:,:,1] * 0.587 + img[:,:,0] * 0.114)
-        elif img.dtype == np.uint8 and len(img.shape) == 2:
-            # Type is already correct, we'll leave alone
-            img8 = img
-        else:
+    def ExportPoses(self, filename):
+        # Saves the stored views and the frame shape they belong to as .npz
+        np.savez(filename, checkershape=np.array(self.checkershape), **self.poses.export())
+        return True
+
+    def ImportPoses(self, filename, append=False):
+        # Loads views saved by ExportPoses, replacing the stored views
+        # unless append is True. Returns the number of views now stored.
+        with np.load(filename) as arrays:
+            checkershape = tuple(int(n) for n in arrays["checkershape"])
+            if not append:
+                self.poses.clear()
+                self.viewerrors = None
+                self.checkershape = None
+            self._CheckShape(checkershape)
+            self.poses.load(arrays)
+        self.viewerrors = None
+        return len(self.poses)
+
+    def CaptureCheckerboardImage(self, nchkw = None, nchkh = None, imgprocess=True, plot=True, pyramidlevels=0, fastcheck=False):
+        boardsize = self._BoardSize(nchkw, nchkh)
+
+        rec = self._NextFrame()
+        img8 = gray8(rec.data(), self._gray8buf)
+        if img8 is None:
             print("Unknown Data Type")
             return False
 
-        if self.checkershape is not None:
-            if self.checkershape != img8.shape:
-                print("Image Shape Has Changed -- Clearing Old Images")
-                self.objpoints = []
-                self.imgpoints = []
-                self.checkershape = img8.shape
-        else:
-            self.checkershape = img8.shape
+        self._gray8buf = img8
+        self._CheckShape(img8.shape)
 
-        if imgprocess:
-            flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
-        else:
-            flags = None
-        ret, corners = cv2.findChessboardCorners(img8, (nchkw, nchkh), flags)
+        corners2 = find_checkerboard_corners(img8, boardsize, imgprocess, pyramidlevels, fastcheck)
 
-        if ret == False:
-            print("Failed to Find Chessboard Pattern -- Try Calling CaptureImage(imgprocess=True) instead")
+        if corners2 is None:
+            if imgprocess:
+                print("Failed to Find Chessboard Pattern")
+            else:
+                print("Failed to Find Chessboard Pattern -- Try Calling CaptureCheckerboardImage(imgprocess=True) instead")
             return False
 
-        objp = np.zeros((nchkw * nchkh, 3), np.float32)
-        objp[:,:2] = np.mgrid[0:nchkw, 0:nchkh].T.reshape(-1,2)
-
-        corners2 = cv2.cornerSubPix(img8, corners, (11,11), (-1,-1), (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001))
-        
-        self.objpoints.append(objp)
-        self.imgpoints.append(corners2)
+        self._StorePose(boardsize, corners2)
 
         if plot:
             plt.ion()
             plt.figure()
-            plt.imshow(img8.T, origin='lower', cmap='gray')
+            plt.imshow(img8.T.copy(), origin='lower', cmap='gray')
             plt.plot(corners2[:,0,1], corners2[:,0,0], 'rx-')
             plt.show()
 
         return True
 
-
-            
-
-        
-
-
+    def CaptureCheckerboardSeries(self, n, interval=1.0, nchkw=None, nchkh=None, imgprocess=True, mindisplacement=10.0, nworkers=None, pyramidlevels=0, fastcheck=False):
+        # Captures n frames from the camera channel, at least interval seconds
+        # apart, and finds the checkerboard in each on a thread pool while the
+        # remaining frames are captured.  Poses whose corners are within
+        # mindisplacement pixels (mean) of an already stored pose are
+        # rejected as near duplicates.  Returns a summary dictionary.
+        # With fastcheck and pyramidlevels (see find_checkerboard_corners)
+        # frames without a board cost milliseconds, so this can run against
+        # a live stream with a short interval.
+        boardsize = self._BoardSize(nchkw, nchkh)
+
+        frameshape = None
+        buffers = None
+        futures = []
+        with ThreadPoolExecutor(max_workers=nworkers) as pool:
+            mon: snde.monitor_globalrevs = self.recdb.start_monitoring_globalrevs()
+            try:
+                lastcapture = None
+                while len(futures) < n:
+                    rev: snde.globalrevision = mon.wait_next(self.recdb)
+                    now = time.monotonic()
+                    if lastcapture is not None and now - lastcapture < interval:
+                        continue
+                    rec = rev.get_ndarray_ref(self.camchannel)
+                    if not frame_valid(rec):
+                        continue
+                    img = rec.data()
+                    if buffers is None:
+                        # One grayscale buffer per frame, since the detector works on them concurrently
+                        buffers = np.empty((n,) + img.shape[:2], dtype=np.uint8)
+                    img8 = gray8(img, buffers[len(futures)])
+                    if img8 is None:
+                        print("Unknown Data Type")
+                        return None
+                    if frameshape is not None and img8.shape != frameshape:
+                        print("Image Shape Changed During Capture -- Ignoring Frame")
+                        continue
+                    frameshape = img8.shape
+                    lastcapture = now
+                    futures.append(pool.submit(find_checkerboard_corners, img8, boardsize, imgprocess, pyramidlevels, fastcheck))
+            finally:
+                mon.close(self.recdb)
+
+            results = [future.result() for future in futures]
+
+        if frameshape is not None:
+            self._CheckShape(frameshape)
+
+        notfound = 0
+        duplicates = 0
+        accepted = 0
+        for corners in results:
+            if corners is None:
+                notfound += 1
+            elif is_duplicate_pose(corners, self.poses.corners(boardsize), mindisplacement):
+                duplicates += 1
+            else:
+                self._StorePose(boardsize, corners)
+                accepted += 1
+
+        return {
+            "Captured": len(results),
+            "NotFound": notfound,
+            "RejectedDuplicates": duplicates,
+            "Accepted": accepted,
+            "TotalPoses": len(self.poses),
+        }
@@ -1,6 +1,9 @@
 import sys
-from threading import Thread
+from threading import Thread, Event, Lock
+from concurrent.futures import Future
 import queue
+import time
+import traceback
 
 from dataguzzler_python.dgpy import Module as dgpy_Module
 from dataguzzler_python.dgpy import InitCompatibleThread
@@ -11,6 +14,10 @@ import cv2
 import numpy as np
 import ctypes
 
+from .ringbuffer import FrameRingBuffer, FullPolicies, DROP_OLDEST
+from .timing import StageTimings
+from .sources import LiveSource
+
 # OpenCV DirectShow Driver Doesn't Report The Correct Value For Auto Params When In Auto Mode
 # Need to report that these were set to auto until we have changed them, then it is kicked out
 # of auto mode automatically.  There is no way to detect if they are in auto mode.
@@ -56,6 +63,73 @@ class ParamAttribute(object):
     pass
     
 
+TimingStages = ("Grab", "Queue", "Transaction", "Metadata", "Allocate", "Copy", "Math", "Total")
+
+
+def common_metadata(shape, paramvals):
+    # Builds the metadata entries common to every frame of the given shape
+    metadata = snde.immutable_metadata()
+    metadata.AddMetaDatum(snde.metadatum_str('ande_array-axis0_coord', 'Y Position'))
+    metadata.AddMetaDatum(snde.metadatum_str('ande_array-axis1_coord', 'X Position'))
+    metadata.AddMetaDatum(snde.metadatum_str('ande_array-axis2_coord', 'Channel'))
+    metadata.AddMetaDatum(snde.metadatum_str('ande_array-ampl_coord', 'Intensity'))
+    metadata.AddMetaDatum(snde.metadatum_str('ande_array-ampl_units', 'Arb'))
+    metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis0_offset', shape[0]/(-2), 'pixels'))
+    metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis1_offset', shape[1]/(-2), 'pixels'))
+    metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis2_offset', 0, 'unitless'))
+    metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis0_scale', 1, 'pixels'))
+    metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis1_scale', 1, 'pixels'))
+    metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis2_scale', 1, 'unitless'))
+    for key in ParamDict:
+        metadata.AddMetaDatum(ParamDict[key][4](ParamDict[key][1](ParamDict[key][2](paramvals[key]))))
+    return metadata
+
+
+def frame_metadata(common, stamp, extra=()):
+    # Per-frame metadata: the cached common metadata merged with just the
+    # frame's timestamps (and any extra metadatums), so only a few entries
+    # are built per frame. The device timestamp is omitted when None.
+    (frameno, hosttime, devicetime, grabstart, grabend) = stamp
+    metadata = snde.constructible_metadata()
+    metadata.AddMetaDatum(snde.metadatum_int('camera_timing-frame_number', frameno))
+    metadata.AddMetaDatum(snde.metadatum_dblunits('camera_timing-host_timestamp', hosttime, 's'))
+    if devicetime is not None:
+        metadata.AddMetaDatum(snde.metadatum_dblunits('camera_timing-device_timestamp', devicetime, 'ms'))
+    for metadatum in extra:
+        metadata.AddMetaDatum(metadatum)
+    return snde.MergeMetadata(common, metadata)
+
+
+def invalid_frame_metadata(metadata):
+    # Flags a frame that was grabbed but could not be retrieved. Its
+    # storage holds zeros rather than an image; see frame_valid().
+    flag = snde.constructible_metadata()
+    flag.AddMetaDatum(snde.metadatum_bool('camera_frame-invalid', True))
+    return snde.MergeMetadata(metadata, flag)
+
+
+def frame_valid(rec):
+    # False for a frame published with invalid_frame_metadata(), which
+    # consumers such as averaging or flat field capture should skip
+    return not rec.rec.metadata.GetMetaDatumBool('camera_frame-invalid', False)
+
+
+def copy_frame(outdata, frame):
+    # Copies frame into the already allocated recording storage outdata.
+    # If the device changed the frame shape without a parameter change we
+    # know of, the frame is published cropped/zero padded and False is
+    # returned so the caller can allocate the next one at the new shape.
+    if frame.shape == outdata.shape:
+        outdata[:] = frame
+        return True
+    sys.stderr.write("Warning: Frame shape changed from %s to %s\n" % (str(outdata.shape), str(frame.shape)))
+    sys.stderr.flush()
+    overlap = tuple(slice(0, min(outlen, framelen)) for (outlen, framelen) in zip(outdata.shape, frame.shape))
+    outdata[:] = 0
+    outdata[overlap] = frame[overlap]
+    return False
+
+
 def add_parameters(cls):
     for paramname in ParamDict:            
         # Create Descriptor for this parameter -- this is so help() works.
@@ -77,23 +151,92 @@ class OpenCVCamera(object, metaclass=dgpy_Module):
     chanptr = None
     cameranum = None
     capdevice = None
+    source = None
     thread = None
-    _quit = False
+    _quit = None
     _paramvals = None
     _queue = None
+    _queuelock = None
+    _accepting = False
     _settings = False
+    ringbuffer = 0
+    bufferpolicy = None
+    _ringbuffer = None
+    _publishthread = None
+    settingspoll = None
+    _lastpoll = None
+    _metadata = None
+    _metadatashape = None
+    _frameshape = None
+    _framebuf = None
+    _framecount = 0
+    devicetimestamp = False
+    _timings = None
+    _completions = None
+    _completionthread = None
+    averages = 1
+    rawdecimation = 1
+    _rawchanptr = None
+    _rawcount = 0
+    _accumulator = None
+    _naccumulated = 0
 
-    def __init__(self, module_name, recdb, cameranum=0, capdevice = cv2.CAP_ANY, enablesettings=False):
+    def __init__(self, module_name, recdb, cameranum=0, capdevice = cv2.CAP_ANY, enablesettings=False, ringbuffer=0, bufferpolicy=DROP_OLDEST, settingspoll=1.0, timing=True, timingwindow=1000, source=None, averages=1, rawchannel=None, rawdecimation=1, devicetimestamp=False):
+        # ringbuffer > 0 selects ring buffer acquisition with that many frame slots:
+        # a grab thread reads frames into the buffer and a separate thread publishes
+        # them without waiting for downstream math. bufferpolicy selects what
+        # happens when the buffer is full: "drop_oldest", "drop_newest" or "block".
+        # With enablesettings, the camera parameters are reread every settingspoll seconds.
+        # With timing, per-stage timings of the last timingwindow frames are kept for GetTimingStats().
+        # With devicetimestamp, each frame's driver timestamp (CAP_PROP_POS_MSEC) is
+        # added to its metadata, at the cost of a vid.get() per frame.
+        # source replaces the capture device (cameranum, capdevice) with e.g. a
+        # SyntheticSource or FileSource from dgpython_opencv_camera.sources.
+        # With averages > 1, frames are summed in the acquisition thread and
+        # only the rounded mean of each averages frames is published, as
+        # uint8 like unaveraged frames so the downstream math is unchanged. Every
+        # rawdecimation-th raw frame is then also published to rawchannel,
+        # if given.
         self.module_name = module_name
         self.recdb = recdb
         self.cameranum = cameranum
         self.capdevice = capdevice
+        if source is None:
+            source = LiveSource(cameranum, capdevice)
+        self.source = source
         self._queue = queue.Queue()
+        self._queuelock = Lock()
+        self._accepting = False
+        self._quit = Event()
         self._settings = False
         self.enablesettings = enablesettings
+        self.settingspoll = settingspoll
+        self.devicetimestamp = devicetimestamp
+        self._lastpoll = 0.0
+        self._metadata = None
+        self._metadatashape = None
+        self._framecount = 0
+        self._timings = None
+        if timing:
+            self._timings = StageTimings(TimingStages, timingwindow)
+        self.ringbuffer = ringbuffer
+        self.bufferpolicy = bufferpolicy
+        if ringbuffer > 0 and bufferpolicy not in FullPolicies:
+            raise ValueError("Unknown buffer full policy %s (must be one of %s)" % (bufferpolicy, ", ".join(FullPolicies)))
+
+        if averages < 1 or rawdecimation < 1:
+            raise ValueError("averages and rawdecimation must be at least 1")
+        self.averages = averages
+        self.rawdecimation = rawdecimation
+        self._rawcount = 0
+        self._accumulator = None
+        self._naccumulated = 0
 
         transact = recdb.start_transaction()
         self.chanptr = recdb.define_channel(module_name, "main", self.recdb.raw())
+        self._rawchanptr = None
+        if rawchannel is not None and averages > 1:
+            self._rawchanptr = recdb.define_channel(rawchannel, "main", self.recdb.raw())
         recdb.end_transaction(transact)
 
         # We need to add an initial frame to get the data type or else the averaging math channel will fail because it will see the null pointer
@@ -113,7 +256,7 @@ class OpenCVCamera(object, metaclass=dgpy_Module):
         rec.rec.metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis1_scale', 1, 'pixels'))
         rec.rec.metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis2_scale', 1, 'unitless'))
         rec.rec.mark_metadata_done()
-        rec.allocate_storage([2, 2, 3], True)
+        rec.allocate_storage([2, 2, 3], False)
         outdata = rec.data()
         outdata[:] = np.zeros([2,2,3], dtype=np.uint8)
         rec.rec.mark_data_ready()
@@ -127,84 +270,383 @@ class OpenCVCamera(object, metaclass=dgpy_Module):
         return ParamDict[name][2](self._paramvals[name])
 
     def SetParam(self, name, value):
-        self._queue.put((name, ParamDict[name][0], ParamDict[name][3](value)))
-        self._queue.join()
-        return self.GetParam(name)
+        result = self.SetParams({name: value})
+        if result is None:
+            return None
+        return result[name]
 
-    def AcquisitionThread(self):
-        InitCompatibleThread(self, "_thread")
+    def SetParams(self, params, wait=True):
+        # Applies a dictionary of parameter changes together, between two
+        # frames, and returns a dictionary of the resulting values. With
+        # wait False, returns a concurrent.futures.Future of that dictionary
+        # immediately instead. If acquisition stops before the changes are
+        # applied, the Future raises RuntimeError.
+        for name in params:
+            if name not in ParamDict:
+                raise KeyError("Unknown parameter %s" % (name))
+        changes = [(name, ParamDict[name][0], ParamDict[name][3](params[name])) for name in params]
+        future = Future()
+        with self._queuelock:
+            # Checked under the lock so the thread can't exit between the
+            # check and the put and leave the Future unresolved
+            if not self._accepting:
+                print("Acquisition Not Running")
+                return None
+            self._queue.put((changes, future))
+        if not wait:
+            return future
+        return future.result()
+
+    def _OpenCapture(self):
+        vid = self.source.open()
 
-        vid = cv2.VideoCapture(self.cameranum, self.capdevice)
-        
         self._paramvals = {}
         for key in ParamDict:
-            self._paramvals[key] = vid.get(ParamDict[key][0])            
+            self._paramvals[key] = vid.get(ParamDict[key][0])
+        self._ParamsChanged()
+
+        return vid
+
+    def _ParamsChanged(self):
+        # Cached metadata is stale, and the frame shape may have changed.
+        # Frames from before the change are not averaged with later ones.
+        self._metadata = None
+        self._frameshape = None
+        self._naccumulated = 0
+
+    def _ServiceSettings(self, vid):
+        # Apply queued parameter changes -- must be called from
+        # the thread that owns vid
+        if self.enablesettings and self._settings:
+            vid.set(cv2.CAP_PROP_SETTINGS, 1)
+            self._settings = False
+        while not self._queue.empty():
+            (changes, future) = self._queue.get(False)
+            try:
+                for (name, propid, value) in changes:
+                    vid.set(propid, value)
+                for (name, propid, value) in changes:
+                    self._paramvals[name] = vid.get(propid)
+            except Exception as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result({name: ParamDict[name][2](self._paramvals[name]) for (name, propid, value) in changes})
+            finally:
+                self._ParamsChanged()
 
+    def _RejectSettings(self):
+        # Called as the thread owning vid exits: fail every queued change
+        # so no SetParams() caller waits forever
+        with self._queuelock:
+            self._accepting = False
+            while not self._queue.empty():
+                (changes, future) = self._queue.get(False)
+                future.set_exception(RuntimeError("Acquisition stopped before the parameter changes were applied"))
+
+    def _PollSettings(self, vid):
+        # With the settings dialog enabled the parameters can change behind
+        # our back, so reread them -- but only every settingspoll seconds
+        if self.enablesettings:
+            now = time.monotonic()
+            if now - self._lastpoll >= self.settingspoll:
+                self._lastpoll = now
+                for key in ParamDict:
+                    val = vid.get(ParamDict[key][0])
+                    if val != self._paramvals[key]:
+                        self._paramvals[key] = val
+                        self._ParamsChanged()
+
+    def _FrameMetadata(self, shape, stamp, extra=()):
+        # The common metadata is only rebuilt when the frame shape or a
+        # camera parameter changes; each frame just merges in its timestamps
+        common = self._metadata
+        if common is None or self._metadatashape != shape:
+            common = common_metadata(shape, self._paramvals)
+            self._metadata = common
+            self._metadatashape = shape
+        return frame_metadata(common, stamp, extra)
+
+    def _FrameStamp(self, vid, grabstart):
+        # Called right after a frame is read: (frame number, host time,
+        # driver timestamp or None, perf_counter at start and end of the grab)
+        grabend = time.perf_counter()
+        self._framecount += 1
+        devicetime = None
+        if self.devicetimestamp:
+            devicetime = vid.get(cv2.CAP_PROP_POS_MSEC)
+        return (self._framecount, time.time(), devicetime, grabstart, grabend)
+
+    def _PublishFrame(self, stamp, frame=None, vid=None, raw=False):
+        # Publishes frame. With frame None, the frame just grabbed from vid is
+        # instead decoded straight into the recording storage, which is
+        # allocated at the last known frame shape. With raw, frame goes to
+        # the raw channel instead (see averages) and is not timed.
+        # Returns the globalrev and the perf_counter time the data was marked ready
+        if frame is not None:
+            shape = frame.shape
+        else:
+            shape = self._frameshape
+        chanptr = self.chanptr
+        if raw:
+            chanptr = self._rawchanptr
+        t0 = time.perf_counter()
+        transact = self.recdb.start_transaction()
+        rec = snde.create_ndarray_ref(self.recdb, chanptr, self.recdb.raw(), snde.SNDE_RTN_UINT8)
+        globalrev = self.recdb.end_transaction(transact)
+        t1 = time.perf_counter()
+        extra = ()
+        if self.averages > 1 and not raw:
+            extra = (snde.metadatum_int('camera_params-averages', self.averages),)
+        metadata = self._FrameMetadata(shape, stamp, extra)
+        t2 = time.perf_counter()
+        # C order so OpenCV can decode into it in place
+        rec.allocate_storage(shape, False)
+        t3 = time.perf_counter()
+        outdata = rec.data()
+        if frame is not None:
+            outdata[:] = frame
+        else:
+            ret, frame = vid.retrieve(image=outdata)
+            if not ret:
+                # Only known once the storage is allocated, so the metadata
+                # is marked done afterwards and flags the frame instead
+                outdata[:] = 0
+                metadata = invalid_frame_metadata(metadata)
+            elif frame is not outdata:
+                self._CopyMismatchedFrame(outdata, frame)
+        rec.rec.metadata = metadata
+        rec.rec.mark_metadata_done()
+        rec.rec.mark_data_ready()
+        t4 = time.perf_counter()
+        if self._timings is not None and not raw:
+            (frameno, hosttime, devicetime, grabstart, grabend) = stamp
+            self._timings.record({
+                "Grab": grabend - grabstart,
+                "Queue": t0 - grabend,
+                "Transaction": t1 - t0,
+                "Metadata": t2 - t1,
+                "Allocate": t3 - t2,
+                "Copy": t4 - t3,
+            })
+        return (globalrev, t4)
+
+    def _AccumulateFrame(self, stamp, frame):
+        # Adds frame to the running sum. Every averages frames the mean is
+        # published, with the timestamps of the last frame, and its globalrev
+        # and ready time returned; otherwise returns None.
+        self._rawcount += 1
+        if self._rawchanptr is not None and self._rawcount % self.rawdecimation == 0:
+            self._PublishFrame(stamp, frame, raw=True)
+
+        accumulator = self._accumulator
+        if accumulator is None or accumulator.shape != frame.shape:
+            # Integer frames are summed exactly; uint32 holds 65537 uint16 frames
+            if frame.dtype.kind == 'f':
+                accumulator = np.empty(frame.shape, dtype=np.float32)
+            else:
+                accumulator = np.empty(frame.shape, dtype=np.uint32)
+            self._accumulator = accumulator
+            self._naccumulated = 0
+        if self._naccumulated == 0:
+            np.copyto(accumulator, frame, casting='unsafe')
+        else:
+            np.add(accumulator, frame, out=accumulator, casting='unsafe')
+        self._naccumulated += 1
+        if self._naccumulated < self.averages:
+            return None
+
+        self._naccumulated = 0
+        # Rounded mean, in place; _PublishFrame converts it to uint8
+        if accumulator.dtype == np.float32:
+            np.multiply(accumulator, 1.0 / self.averages, out=accumulator)
+            np.rint(accumulator, out=accumulator)
+        else:
+            np.add(accumulator, self.averages // 2, out=accumulator)
+            np.floor_divide(accumulator, self.averages, out=accumulator)
+        return self._PublishFrame(stamp, accumulator)
+
+    def _CopyMismatchedFrame(self, outdata, frame):
+        # OpenCV could not decode into the storage we allocated
+        if not copy_frame(outdata, frame):
+            self._ParamsChanged()
+
+    def _RecordCompletion(self, globalrev, readytime, stamp):
+        globalrev.wait_complete()
+        if self._timings is not None:
+            now = time.perf_counter()
+            self._timings.record({"Math": now - readytime, "Total": now - stamp[3]})
+
+    def AcquisitionThread(self):
+        InitCompatibleThread(self, "_thread")
+
+        vid = None
         try:
-            while not self._quit:
-                if self.enablesettings and self._settings:
-                    vid.set(cv2.CAP_PROP_SETTINGS, 1)
-                    self._settings = False
-                while not self._queue.empty():
-                    item = self._queue.get(False)
-                    vid.set(item[1], item[2])
-                    self._paramvals[item[0]] = vid.get(item[1])
-                    self._queue.task_done()
-                ret, frame = vid.read()
+            vid = self._OpenCapture()
+            while not self._quit.is_set():
+                self._ServiceSettings(vid)
+                grabstart = time.perf_counter()
+                if self._frameshape is None or self.averages > 1:
+                    # First frame, or a parameter changed: decode into a reusable
+                    # buffer to learn the shape, then copy into the recording.
+                    # When averaging, every frame is decoded here and summed.
+                    ret, frame = vid.read(image=self._framebuf)
+                    if ret:
+                        self._framebuf = frame
+                        self._frameshape = frame.shape
+                else:
+                    # Shape is known: just grab here and let _PublishFrame decode
+                    # the frame straight into the recording storage
+                    ret = vid.grab()
+                    frame = None
                 if ret:
-                    transact = self.recdb.start_transaction()
-                    rec = snde.create_ndarray_ref(self.recdb, self.chanptr, self.recdb.raw(), snde.SNDE_RTN_UINT8)
-                    globalrev = self.recdb.end_transaction(transact)
-                    rec.rec.metadata = snde.immutable_metadata()
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_str('ande_array-axis0_coord', 'Y Position'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_str('ande_array-axis1_coord', 'X Position'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_str('ande_array-axis2_coord', 'Channel'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_str('ande_array-ampl_coord', 'Intensity'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_str('ande_array-ampl_units', 'Arb'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis0_offset', frame.shape[0]/(-2), 'pixels'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis1_offset', frame.shape[1]/(-2), 'pixels'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis2_offset', 0, 'unitless'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis0_scale', 1, 'pixels'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis1_scale', 1, 'pixels'))
-                    rec.rec.metadata.AddMetaDatum(snde.metadatum_dblunits('ande_array-axis2_scale', 1, 'unitless'))
-                    if self.enablesettings:
-                        for key in ParamDict:
-                            self._paramvals[key] = vid.get(ParamDict[key][0]) 
-                    for key in ParamDict:
-                        rec.rec.metadata.AddMetaDatum(ParamDict[key][4](ParamDict[key][1](ParamDict[key][2](self._paramvals[key]))))
-                    rec.rec.mark_metadata_done()
-                    rec.allocate_storage(frame.shape, True)
-                    outdata = rec.data()
-                    outdata[:] = frame
-                    rec.rec.mark_data_ready()
-                    globalrev.wait_complete()
+                    stamp = self._FrameStamp(vid, grabstart)
+                    self._PollSettings(vid)
+                    if self.averages > 1:
+                        published = self._AccumulateFrame(stamp, frame)
+                        if published is not None:
+                            self._RecordCompletion(*published, stamp)
+                        continue
+                    (globalrev, readytime) = self._PublishFrame(stamp, frame, vid)
+                    self._RecordCompletion(globalrev, readytime, stamp)
         finally:
-            self.vid.release()
+            self._RejectSettings()
+            if vid is not None:
+                vid.release()
+
+    def GrabThread(self):
+        # Ring buffer mode: only pull frames off the device. Publishing
+        # happens in PublishThread so downstream math can't stall capture.
+        InitCompatibleThread(self, "_grabthread")
+
+        vid = None
+        try:
+            vid = self._OpenCapture()
+            while not self._quit.is_set():
+                self._ServiceSettings(vid)
+                slot = self._ringbuffer.acquire_write()
+                if slot is None:
+                    # Frame is being dropped -- take it off the device without decoding it
+                    vid.grab()
+                    continue
+                # OpenCV decodes into the slot array unless the frame shape changed
+                grabstart = time.perf_counter()
+                ret, frame = vid.read(image=self._ringbuffer.slots[slot])
+                if ret:
+                    self._ringbuffer.slots[slot] = frame
+                    self._ringbuffer.stamps[slot] = self._FrameStamp(vid, grabstart)
+                    self._PollSettings(vid)
+                    self._ringbuffer.commit_write(slot)
+                else:
+                    self._ringbuffer.cancel_write(slot)
+        finally:
+            self._RejectSettings()
+            self._ringbuffer.close()
+            if vid is not None:
+                vid.release()
+
+    def PublishThread(self):
+        InitCompatibleThread(self, "_publishthread")
+
+        while True:
+            slot = self._ringbuffer.acquire_read()
+            if slot is None:
+                break
+            try:
+                stamp = self._ringbuffer.stamps[slot]
+                if self.averages > 1:
+                    published = self._AccumulateFrame(stamp, self._ringbuffer.slots[slot])
+                else:
+                    published = self._PublishFrame(stamp, self._ringbuffer.slots[slot])
+            except Exception:
+                # Keep consuming, or a grab thread blocked on a full buffer would never wake
+                sys.stderr.write("Warning: Failed to publish frame\n%s" % (traceback.format_exc()))
+                sys.stderr.flush()
+                published = None
+            finally:
+                self._ringbuffer.release_read(slot)
+            if published is None:
+                continue
+            (globalrev, readytime) = published
+            if self._completions is not None:
+                # Math timing is measured by CompletionThread so publishing never waits
+                try:
+                    self._completions.put_nowait((globalrev, readytime, stamp))
+                except queue.Full:
+                    pass
+
+    def CompletionThread(self):
+        # Ring buffer mode with timing: waits for each published globalrev
+        # to complete, in order, to measure the downstream math
+        InitCompatibleThread(self, "_completionthread")
+
+        while True:
+            item = self._completions.get()
+            if item is None:
+                break
+            self._RecordCompletion(*item)
+
+    def GetTimingStats(self):
+        # Rolling statistics (milliseconds) of each stage between the device
+        # read and completion of the downstream math, over the last
+        # timingwindow frames
+        if self._timings is None:
+            print("Timing Not Enabled")
+            return None
+        return self._timings.stats()
+
+    def ResetTimingStats(self):
+        if self._timings is not None:
+            self._timings.reset()
+
+    def GetBufferStats(self):
+        if self._ringbuffer is None:
+            print("Ring Buffer Acquisition Not Enabled")
+            return None
+        return self._ringbuffer.stats()
 
     def StartAcquisition(self):
         if self.thread is not None:
-            if self.thread.isAlive():
+            if self.thread.is_alive():
                 sys.stderr.write("Warning: Acquisition Thread Already Running\n")
                 sys.stderr.flush()
                 return
         
-        self._quit = False
-        self.thread = Thread(target=self.AcquisitionThread, daemon=True)
-        self.thread.start()
+        self._quit.clear()
+        self._accepting = True
+        if self.ringbuffer > 0:
+            self._ringbuffer = FrameRingBuffer(self.ringbuffer, self.bufferpolicy)
+            if self._timings is not None:
+                self._completions = queue.Queue(maxsize=4 * self.ringbuffer)
+                self._completionthread = Thread(target=self.CompletionThread, daemon=True)
+                self._completionthread.start()
+            self.thread = Thread(target=self.GrabThread, daemon=True)
+            self._publishthread = Thread(target=self.PublishThread, daemon=True)
+            self.thread.start()
+            self._publishthread.start()
+        else:
+            self.thread = Thread(target=self.AcquisitionThread, daemon=True)
+            self.thread.start()
 
     def RestartAcquisition(self):
-        if self.thread is not None:
-            self._quit = True
-            while self.thread.isAlive():
-                pass    
-
+        self.StopAcquisition()
         self.StartAcquisition()
 
     def StopAcquisition(self):
         if self.thread is not None:
-            self._quit = True
-            while self.thread.isAlive():
-                pass           
-
+            self._quit.set()
+            # Closing the ring buffer for writing wakes a grab thread blocked
+            # on a full buffer. The grab thread closes it completely as it
+            # exits, after its last commit, and the publish thread then
+            # drains what is queued and exits.
+            if self._ringbuffer is not None:
+                self._ringbuffer.close_write()
+            self.thread.join()
+            if self._publishthread is not None:
+                self._publishthread.join()
+                self._publishthread = None
+            if self._completionthread is not None:
+                self._completions.put(None)
+                self._completionthread.join()
+                self._completionthread = None
 
     pass
\ No newline at end of file
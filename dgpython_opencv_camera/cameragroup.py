@@ -0,0 +1,348 @@
+import sys
+import threading
+from threading import Thread, Event, Lock
+from concurrent.futures import Future
+import queue
+import time
+
+from dataguzzler_python.dgpy import Module as dgpy_Module
+from dataguzzler_python.dgpy import InitCompatibleThread
+
+import spatialnde2 as snde
+
+import cv2
+import numpy as np
+
+from .camera import ParamDict, common_metadata, frame_metadata, invalid_frame_metadata, copy_frame
+from .timing import StageTimings
+from .sources import LiveSource
+
+GroupTimingStages = ("Skew", "Grab", "Transaction", "Retrieve", "Math", "Total")
+
+
+class OpenCVCameraGroup(object, metaclass=dgpy_Module):
+    # Several cameras acquired in lockstep.  Each camera has its own
+    # thread, which owns its device, so decoding and copying scale across
+    # cores.  For every frame set all the threads grab() first; once every
+    # camera has grabbed, a single recdb transaction creates the recordings
+    # of the whole set, and then each thread retrieve()s its frame straight
+    # into its recording's storage.  The skew of a set is the spread of the
+    # times the cameras' grabs completed.
+    recdb = None
+    channels = None
+    chanptrs = None
+    sources = None
+    threads = None
+    _quit = None
+    _running = False
+    _paramvals = None
+    _queues = None
+    _queuelock = None
+    _accepting = False
+    _metadata = None
+    _metadatashape = None
+    _frameshape = None
+    _framebuf = None
+    _grabs = None
+    _retrieved = None
+    _recs = None
+    _globalrev = None
+    _transacttime = None
+    _skew = None
+    _framesets = 0
+    _grabbarrier = None
+    _publishbarrier = None
+    _timings = None
+    devicetimestamp = False
+
+    def __init__(self, module_name, recdb, channels, sources=None, capdevice=cv2.CAP_ANY, timing=True, timingwindow=1000, devicetimestamp=False):
+        # channels is a list of channel names, one per camera. sources is a
+        # matching list of frame sources (see dgpython_opencv_camera.sources);
+        # by default camera i is device i opened with capdevice.
+        # With timing, the skew and per-stage timings of the last timingwindow
+        # frame sets are kept for GetTimingStats(). With devicetimestamp, each
+        # frame's driver timestamp is added to its metadata.
+        self.module_name = module_name
+        self.recdb = recdb
+        self.channels = list(channels)
+        if sources is None:
+            sources = [LiveSource(cameranum, capdevice) for cameranum in range(len(self.channels))]
+        if len(sources) != len(self.channels):
+            raise ValueError("Need one source per channel (got %d sources for %d channels)" % (len(sources), len(self.channels)))
+        self.sources = list(sources)
+        self.devicetimestamp = devicetimestamp
+        ncameras = len(self.channels)
+        self._queues = [queue.Queue() for cnt in range(ncameras)]
+        self._queuelock = Lock()
+        self._accepting = False
+        self._quit = Event()
+        self._paramvals = [None] * ncameras
+        self._metadata = [None] * ncameras
+        self._metadatashape = [None] * ncameras
+        self._frameshape = [None] * ncameras
+        self._framebuf = [None] * ncameras
+        self._grabs = [None] * ncameras
+        self._retrieved = [None] * ncameras
+        self._recs = [None] * ncameras
+        self._framesets = 0
+        self._timings = None
+        if timing:
+            self._timings = StageTimings(GroupTimingStages, timingwindow)
+
+        transact = recdb.start_transaction()
+        self.chanptrs = [recdb.define_channel(channel, "main", self.recdb.raw()) for channel in self.channels]
+        recdb.end_transaction(transact)
+
+        # Initial frames so downstream math sees the data type
+        transact = self.recdb.start_transaction()
+        recs = [snde.create_ndarray_ref(self.recdb, chanptr, self.recdb.raw(), snde.SNDE_RTN_UINT8) for chanptr in self.chanptrs]
+        globalrev = self.recdb.end_transaction(transact)
+        for rec in recs:
+            rec.rec.metadata = snde.immutable_metadata()
+            rec.rec.mark_metadata_done()
+            rec.allocate_storage([2, 2, 3], False)
+            outdata = rec.data()
+            outdata[:] = np.zeros([2,2,3], dtype=np.uint8)
+            rec.rec.mark_data_ready()
+
+        self.StartAcquisition()
+
+    def GetParam(self, camera, name):
+        return ParamDict[name][2](self._paramvals[camera][name])
+
+    def SetParam(self, camera, name, value):
+        # Applied by the camera's thread between two frame sets. Raises
+        # RuntimeError if acquisition is not running, or stops before the
+        # change is applied.
+        future = Future()
+        with self._queuelock:
+            # Checked under the lock so a camera thread can't exit between
+            # the check and the put and leave the Future unresolved
+            if not self._accepting:
+                raise RuntimeError("Acquisition Not Running")
+            self._queues[camera].put((name, ParamDict[name][0], ParamDict[name][3](value), future))
+        return future.result()
+
+    def _OpenCapture(self, index):
+        vid = self.sources[index].open()
+
+        paramvals = {}
+        for key in ParamDict:
+            paramvals[key] = vid.get(ParamDict[key][0])
+        self._paramvals[index] = paramvals
+        self._metadata[index] = None
+        self._frameshape[index] = None
+
+        return vid
+
+    def _ServiceSettings(self, index, vid):
+        camqueue = self._queues[index]
+        while not camqueue.empty():
+            (name, propid, value, future) = camqueue.get(False)
+            try:
+                vid.set(propid, value)
+                self._paramvals[index][name] = vid.get(propid)
+            except Exception as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(self.GetParam(index, name))
+            finally:
+                self._metadata[index] = None
+                self._frameshape[index] = None
+
+    def _RejectSettings(self, index):
+        # Called as a camera thread exits: stop accepting changes and fail
+        # those queued for this camera so no SetParam() caller waits forever
+        with self._queuelock:
+            self._accepting = False
+            camqueue = self._queues[index]
+            while not camqueue.empty():
+                (name, propid, value, future) = camqueue.get(False)
+                future.set_exception(RuntimeError("Acquisition stopped before the parameter change was applied"))
+
+    def _CommonMetadata(self, index, shape):
+        common = self._metadata[index]
+        if common is None or self._metadatashape[index] != shape:
+            common = common_metadata(shape, self._paramvals[index])
+            self._metadata[index] = common
+            self._metadatashape[index] = shape
+        return common
+
+    def _GrabFrame(self, index, vid):
+        # Grab only; the frame is decoded once the whole set is grabbed.
+        # Until the frame shape is known it is decoded here into a
+        # reusable buffer instead.
+        grabstart = time.perf_counter()
+        ret = vid.grab()
+        frame = None
+        if ret and self._frameshape[index] is None:
+            ret, frame = vid.retrieve(image=self._framebuf[index])
+            if ret:
+                self._framebuf[index] = frame
+                self._frameshape[index] = frame.shape
+        grabend = time.perf_counter()
+        devicetime = None
+        if self.devicetimestamp:
+            devicetime = vid.get(cv2.CAP_PROP_POS_MSEC)
+        self._grabs[index] = (ret, frame, grabstart, grabend, time.time(), devicetime)
+
+    def _BeginFrameSet(self):
+        # Barrier action once every camera has grabbed: one transaction
+        # for the recordings of all cameras whose grab succeeded
+        grabbed = [index for index in range(len(self.channels)) if self._grabs[index][0]]
+        self._recs = [None] * len(self.channels)
+        self._globalrev = None
+        if len(grabbed) == 0:
+            return
+        grabends = [self._grabs[index][3] for index in grabbed]
+        self._skew = max(grabends) - min(grabends)
+        self._framesets += 1
+        t0 = time.perf_counter()
+        transact = self.recdb.start_transaction()
+        for index in grabbed:
+            self._recs[index] = snde.create_ndarray_ref(self.recdb, self.chanptrs[index], self.recdb.raw(), snde.SNDE_RTN_UINT8)
+        self._globalrev = self.recdb.end_transaction(transact)
+        self._transacttime = time.perf_counter() - t0
+
+    def _PublishFrame(self, index, vid, rec):
+        (ret, frame, grabstart, grabend, hosttime, devicetime) = self._grabs[index]
+        if frame is not None:
+            shape = frame.shape
+        else:
+            shape = self._frameshape[index]
+        metadatadone = False
+        allocated = False
+        try:
+            metadata = frame_metadata(self._CommonMetadata(index, shape), (self._framesets, hosttime, devicetime, grabstart, grabend),
+                                      (snde.metadatum_dblunits('camera_timing-group_skew', self._skew, 's'),))
+            rec.allocate_storage(shape, False)
+            allocated = True
+            outdata = rec.data()
+            if frame is not None:
+                outdata[:] = frame
+            else:
+                ret, frame = vid.retrieve(image=outdata)
+                if not ret:
+                    # Flagged so consumers skip it, see OpenCVCamera._PublishFrame
+                    outdata[:] = 0
+                    metadata = invalid_frame_metadata(metadata)
+                elif frame is not outdata:
+                    if not copy_frame(outdata, frame):
+                        self._metadata[index] = None
+                        self._frameshape[index] = None
+            rec.rec.metadata = metadata
+            rec.rec.mark_metadata_done()
+            metadatadone = True
+        except Exception:
+            # The recording is part of the set's transaction, so leave it
+            # complete (and flagged invalid) rather than stall the whole globalrev
+            if not metadatadone:
+                rec.rec.metadata = invalid_frame_metadata(snde.immutable_metadata())
+                rec.rec.mark_metadata_done()
+            if not allocated:
+                rec.allocate_storage([0, 0, 3], False)
+            rec.rec.mark_data_ready()
+            raise
+        rec.rec.mark_data_ready()
+        self._retrieved[index] = time.perf_counter()
+
+    def _EndFrameSet(self):
+        # Barrier action before the next grab: decides for every thread at
+        # once whether to stop, then waits for the downstream math on the
+        # previous set, as OpenCVCamera does without a ring buffer
+        self._running = not self._quit.is_set()
+        globalrev = self._globalrev
+        if globalrev is None:
+            return
+        self._globalrev = None
+        published = [index for index in range(len(self.channels)) if self._recs[index] is not None]
+        grabstart = min(self._grabs[index][2] for index in published)
+        grabend = max(self._grabs[index][3] for index in published)
+        readytime = max(self._retrieved[index] for index in published)
+        globalrev.wait_complete()
+        if self._timings is not None:
+            now = time.perf_counter()
+            self._timings.record({
+                "Skew": self._skew,
+                "Grab": grabend - grabstart,
+                "Transaction": self._transacttime,
+                "Retrieve": readytime - grabend - self._transacttime,
+                "Math": now - readytime,
+                "Total": now - grabstart,
+            })
+
+    def CameraThread(self, index):
+        InitCompatibleThread(self, "_camerathread%d" % (index))
+
+        vid = None
+        stopped = False
+        try:
+            vid = self._OpenCapture(index)
+            while True:
+                self._grabbarrier.wait()
+                if not self._running:
+                    # Every thread sees the same decision, between two sets
+                    stopped = True
+                    break
+                self._ServiceSettings(index, vid)
+                self._GrabFrame(index, vid)
+                self._publishbarrier.wait()
+                rec = self._recs[index]
+                if rec is not None:
+                    self._PublishFrame(index, vid, rec)
+        except threading.BrokenBarrierError:
+            # Another camera failed
+            pass
+        finally:
+            if not stopped:
+                # This camera failed: release the others. Any that already
+                # hold a recording of the current set finish it first.
+                self._grabbarrier.abort()
+                self._publishbarrier.abort()
+            # Nothing will apply queued parameter changes now
+            self._RejectSettings(index)
+            if vid is not None:
+                vid.release()
+
+    def GetTimingStats(self):
+        # Rolling statistics (milliseconds) over the last timingwindow frame
+        # sets. Skew is the spread of grab completion times between cameras.
+        if self._timings is None:
+            print("Timing Not Enabled")
+            return None
+        return self._timings.stats()
+
+    def ResetTimingStats(self):
+        if self._timings is not None:
+            self._timings.reset()
+
+    def StartAcquisition(self):
+        if self.threads is not None:
+            if any(thread.is_alive() for thread in self.threads):
+                sys.stderr.write("Warning: Acquisition Threads Already Running\n")
+                sys.stderr.flush()
+                return
+
+        self._quit.clear()
+        self._running = True
+        self._accepting = True
+        ncameras = len(self.channels)
+        self._grabbarrier = threading.Barrier(ncameras, action=self._EndFrameSet)
+        self._publishbarrier = threading.Barrier(ncameras, action=self._BeginFrameSet)
+        self.threads = [Thread(target=self.CameraThread, args=(index,), daemon=True) for index in range(ncameras)]
+        for thread in self.threads:
+            thread.start()
+
+    def RestartAcquisition(self):
+        self.StopAcquisition()
+        self.StartAcquisition()
+
+    def StopAcquisition(self):
+        if self.threads is not None:
+            # The threads finish the current frame set and stop together at
+            # the next grab barrier, so no set is left partly published
+            self._quit.set()
+            for thread in self.threads:
+                thread.join()
+
+    pass
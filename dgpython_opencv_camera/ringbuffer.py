@@ -0,0 +1,131 @@
+import collections
+import threading
+
+# Policies for when the grab thread has a new frame but every slot is
+# still waiting to be published
+DROP_OLDEST = "drop_oldest"  # Overwrite the oldest frame not yet published
+DROP_NEWEST = "drop_newest"  # Discard the incoming frame
+BLOCK = "block"  # Wait for the publish thread to free a slot
+
+FullPolicies = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class FrameRingBuffer(object):
+    # Bounded set of frame slots passed between a grab thread (producer)
+    # and a publish thread (consumer).  Each slot holds a numpy array that
+    # OpenCV decodes into, so after the first frame (or a change of frame
+    # shape) no allocation happens per frame.  A slot is always in exactly
+    # one of: the free list, the queue of frames waiting to be published,
+    # or held by one of the two threads.  Shutting down takes two steps:
+    # close_write() turns the writer away (waking it if it is blocked), and
+    # close(), once the writer has exited, lets the reader return None
+    # after it has drained every committed frame.
+    capacity = None
+    policy = None
+    slots = None
+    stamps = None
+    dropped = None
+    grabbed = None
+    published = None
+    _free = None
+    _queued = None
+    _cond = None
+    _writeclosed = False
+    _closed = False
+
+    def __init__(self, capacity, policy=DROP_OLDEST):
+        if capacity < 2:
+            raise ValueError("Ring buffer needs at least two slots")
+        if policy not in FullPolicies:
+            raise ValueError("Unknown buffer full policy %s (must be one of %s)" % (policy, ", ".join(FullPolicies)))
+
+        self.capacity = capacity
+        self.policy = policy
+        self.slots = [None] * capacity
+        self.stamps = [None] * capacity  # per-slot frame timestamps, see OpenCVCamera._FrameStamp
+        self.dropped = 0
+        self.grabbed = 0
+        self.published = 0
+        self._free = collections.deque(range(capacity))
+        self._queued = collections.deque()
+        self._cond = threading.Condition()
+        self._writeclosed = False
+        self._closed = False
+
+    def acquire_write(self):
+        # Returns the index of the slot to read the next frame into, or
+        # None if the next frame must be discarded or the buffer is closed
+        # for writing
+        with self._cond:
+            if self._writeclosed:
+                return None
+            while not self._free:
+                if self._writeclosed:
+                    return None
+                if self.policy == BLOCK:
+                    self._cond.wait()
+                    continue
+                self.dropped += 1
+                if self.policy == DROP_OLDEST and self._queued:
+                    return self._queued.popleft()
+                # DROP_NEWEST, or every slot is held by the publish thread
+                return None
+            return self._free.popleft()
+
+    def commit_write(self, slot):
+        with self._cond:
+            self._queued.append(slot)
+            self.grabbed += 1
+            self._cond.notify_all()
+
+    def cancel_write(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def acquire_read(self):
+        # Returns the index of the oldest queued frame, waiting for one
+        # if necessary. Returns None once the buffer is closed and drained.
+        with self._cond:
+            while not self._queued:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            return self._queued.popleft()
+
+    def release_read(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self.published += 1
+            self._cond.notify_all()
+
+    def close_write(self):
+        # No more slots are handed to the writer. A frame it already holds
+        # can still be committed and will be published.
+        with self._cond:
+            self._writeclosed = True
+            self._cond.notify_all()
+
+    def close(self):
+        # The writer is done: once the queue is drained the reader gets None
+        with self._cond:
+            self._writeclosed = True
+            self._closed = True
+            self._cond.notify_all()
+
+    def depth(self):
+        with self._cond:
+            return len(self._queued)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "Capacity": self.capacity,
+                "Policy": self.policy,
+                "QueueDepth": len(self._queued),
+                "DroppedFrames": self.dropped,
+                "GrabbedFrames": self.grabbed,
+                "PublishedFrames": self.published,
+            }
+
+    pass
@@ -0,0 +1,297 @@
+from abc import ABC, abstractmethod
+import glob
+import os
+import os.path
+import time
+
+import cv2
+import numpy as np
+
+# Frame sources for OpenCVCamera. A source is a small factory whose open()
+# is called from the acquisition thread and returns an object with the
+# subset of the cv2.VideoCapture interface the camera uses: read(), grab(),
+# retrieve(), get(), set(), isOpened() and release().
+
+
+class LiveSource(object):
+    # A physical device through cv2.VideoCapture (the default)
+    cameranum = None
+    capdevice = None
+
+    def __init__(self, cameranum=0, capdevice=cv2.CAP_ANY):
+        self.cameranum = cameranum
+        self.capdevice = capdevice
+
+    def open(self):
+        return cv2.VideoCapture(self.cameranum, self.capdevice)
+
+    pass
+
+
+class SyntheticSource(object):
+    # Generated test pattern, for benchmarking and testing without a camera.
+    # pattern is "bars" (moving vertical color bars), "checkerboard"
+    # (a board drifting across the frame, detectable by OpenCVCalibration)
+    # or "noise". fps=None replays as fast as frames are consumed.
+    width = None
+    height = None
+    fps = None
+    pattern = None
+
+    def __init__(self, width=640, height=480, fps=None, pattern="bars"):
+        if pattern not in SyntheticCapture.Patterns:
+            raise ValueError("Unknown pattern %s (must be one of %s)" % (pattern, ", ".join(SyntheticCapture.Patterns)))
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.pattern = pattern
+
+    def open(self):
+        return SyntheticCapture(self.width, self.height, self.fps, self.pattern)
+
+    pass
+
+
+class FileSource(object):
+    # Replays a video file, or an image sequence given as a directory or a
+    # glob pattern (images are loaded into memory up front so replay speed
+    # does not depend on the disk). fps=None replays as fast as frames are
+    # consumed. With loop, replay restarts at the end instead of failing reads.
+    path = None
+    fps = None
+    loop = None
+
+    def __init__(self, path, fps=None, loop=True):
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+
+    def open(self):
+        if os.path.isdir(self.path) or glob.has_magic(self.path):
+            return ImageSequenceCapture(self.path, self.fps, self.loop)
+        return VideoFileCapture(self.path, self.fps, self.loop)
+
+    pass
+
+
+class ReplayCapture(ABC):
+    # Common part of the non-device captures: rate throttling, timestamps,
+    # and the VideoCapture property interface. Subclasses must implement
+    # _advance() and _retrieve() to be instantiated; frames are 8-bit BGR
+    # like VideoCapture's.
+    fps = None
+    framenum = None
+    _start = None
+    _props = None
+
+    def __init__(self, fps):
+        self.fps = fps
+        self.framenum = 0
+        self._start = time.perf_counter()
+        self._props = {}
+
+    def _throttle(self):
+        if self.fps:
+            delay = self._start + self.framenum / self.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    @abstractmethod
+    def _advance(self):
+        # Moves to the next frame, returns False if there is none
+        pass
+
+    @abstractmethod
+    def _retrieve(self, image):
+        # Returns (ret, frame) for the current frame, decoding or copying
+        # into image when it is a compatible buffer, as
+        # cv2.VideoCapture.retrieve(image=...) does
+        pass
+
+    @staticmethod
+    def _copyframe(frame, image):
+        # _retrieve() for captures that hold the frame as a numpy array
+        if frame is None:
+            return (False, image)
+        if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+            np.copyto(image, frame)
+            return (True, image)
+        return (True, frame.copy())
+
+    def grab(self):
+        self._throttle()
+        if not self._advance():
+            return False
+        self.framenum += 1
+        return True
+
+    def retrieve(self, image=None, flag=0):
+        return self._retrieve(image)
+
+    def read(self, image=None):
+        if not self.grab():
+            return (False, image)
+        return self.retrieve(image)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return (time.perf_counter() - self._start) * 1000.0
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.framenum
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps or 0
+        return self._props.get(prop, 0)
+
+    def set(self, prop, value):
+        self._props[prop] = value
+        return True
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+    pass
+
+
+class SyntheticCapture(ReplayCapture):
+    Patterns = ("bars", "checkerboard", "noise")
+
+    width = None
+    height = None
+    pattern = None
+    _canvas = None
+    _period = None
+
+    def __init__(self, width, height, fps, pattern):
+        super().__init__(fps)
+        self.pattern = pattern
+        self._resize(int(width), int(height))
+
+    def _resize(self, width, height):
+        # Frames are windows into a precomputed canvas wider than the
+        # frame, so producing a frame is just a copy
+        self.width = width
+        self.height = height
+        self._period = max(width // 4, 1)
+        canvaswidth = width + self._period
+        if self.pattern == "bars":
+            x = np.arange(canvaswidth)
+            phase = 2 * np.pi * x / self._period
+            row = np.stack([127.5 + 127.5 * np.sin(phase + offset) for offset in (0, 2.1, 4.2)], axis=-1)
+            self._canvas = np.ascontiguousarray(np.broadcast_to(row.astype(np.uint8), (height, canvaswidth, 3)))
+        elif self.pattern == "checkerboard":
+            self._canvas = np.zeros((height, canvaswidth, 3), dtype=np.uint8) + 255
+            # 10x7 squares (9x6 inner corners, as in demos/camera.dgp) that stay in frame as it drifts
+            square = max(min(width // 16, height // 10), 4)
+            (y0, x0) = ((height - 7 * square) // 2, width // 16 + self._period)
+            for row in range(7):
+                for col in range(10):
+                    if (row + col) % 2 == 0:
+                        self._canvas[y0 + row * square:y0 + (row + 1) * square, x0 + col * square:x0 + (col + 1) * square, :] = 0
+        else:
+            self._canvas = np.random.default_rng(0).integers(0, 256, size=(height, canvaswidth, 3), dtype=np.uint8)
+
+    def _advance(self):
+        return True
+
+    def _retrieve(self, image):
+        offset = self.framenum % self._period
+        return self._copyframe(self._canvas[:, offset:offset + self.width, :], image)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        return super().get(prop)
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self._resize(int(value), self.height)
+            return True
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self._resize(self.width, int(value))
+            return True
+        return super().set(prop, value)
+
+    pass
+
+
+class ImageSequenceCapture(ReplayCapture):
+    loop = None
+    _frames = None
+    _index = None
+
+    def __init__(self, path, fps, loop):
+        super().__init__(fps)
+        self.loop = loop
+        if os.path.isdir(path):
+            filenames = sorted(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            filenames = sorted(glob.glob(path))
+        # IMREAD_COLOR gives 8-bit BGR whatever the file holds (gray, alpha,
+        # 16-bit), matching what VideoCapture produces
+        self._frames = [frame for frame in (cv2.imread(filename, cv2.IMREAD_COLOR) for filename in filenames) if frame is not None]
+        if len(self._frames) == 0:
+            raise IOError("No readable images in %s" % (path))
+        self._index = -1
+
+    def _advance(self):
+        self._index += 1
+        if self._index >= len(self._frames):
+            if not self.loop:
+                return False
+            self._index = 0
+        return True
+
+    def _retrieve(self, image):
+        if self._index < 0 or self._index >= len(self._frames):
+            return (False, image)
+        return self._copyframe(self._frames[self._index], image)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self._frames[0].shape[1]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self._frames[0].shape[0]
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self._frames)
+        return super().get(prop)
+
+    pass
+
+
+class VideoFileCapture(ReplayCapture):
+    loop = None
+    _vid = None
+
+    def __init__(self, path, fps, loop):
+        super().__init__(fps)
+        self.loop = loop
+        self._vid = cv2.VideoCapture(path)
+        if not self._vid.isOpened():
+            raise IOError("Could not open video file %s" % (path))
+
+    def _advance(self):
+        if self._vid.grab():
+            return True
+        if not self.loop:
+            return False
+        self._vid.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self._vid.grab()
+
+    def _retrieve(self, image):
+        # The file decoder can decode straight into the caller's buffer
+        return self._vid.retrieve(image)
+
+    def get(self, prop):
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FRAME_COUNT):
+            return self._vid.get(prop)
+        return super().get(prop)
+
+    def release(self):
+        self._vid.release()
+
+    pass
@@ -0,0 +1,58 @@
+import collections
+import threading
+
+import numpy as np
+
+# Histogram bin edges in milliseconds, roughly logarithmic
+HistogramEdges = (0.0, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0, np.inf)
+
+
+class StageTimings(object):
+    # Rolling window of the most recent durations of each pipeline stage.
+    # Durations are recorded in seconds by the acquisition threads and
+    # reported in milliseconds by stats().
+    stages = None
+    window = None
+    _samples = None
+    _lock = None
+
+    def __init__(self, stages, window=1000):
+        self.stages = tuple(stages)
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._samples = {stage: collections.deque(maxlen=self.window) for stage in self.stages}
+
+    def record(self, durations):
+        # durations is a dictionary of stage name to seconds
+        with self._lock:
+            for stage in durations:
+                self._samples[stage].append(durations[stage])
+
+    def stats(self):
+        with self._lock:
+            samples = {stage: np.array(self._samples[stage]) * 1000.0 for stage in self.stages}
+
+        result = {}
+        for stage in self.stages:
+            ms = samples[stage]
+            if len(ms) == 0:
+                result[stage] = {"Count": 0}
+                continue
+            (counts, edges) = np.histogram(ms, bins=HistogramEdges)
+            result[stage] = {
+                "Count": len(ms),
+                "Mean_ms": float(ms.mean()),
+                "Min_ms": float(ms.min()),
+                "P50_ms": float(np.percentile(ms, 50)),
+                "P95_ms": float(np.percentile(ms, 95)),
+                "P99_ms": float(np.percentile(ms, 99)),
+                "Max_ms": float(ms.max()),
+                "Histogram": list(zip(HistogramEdges[1:], counts.tolist())),
+            }
+        return result
+
+    pass
@@ -29,6 +29,7 @@ spatialnde2_compile_libraries_cmake = open(os.path.join(os.path.dirname(snde.__f
 
 spatialnde2_compile_libraries_cmake.append('opencv_core460')
 spatialnde2_compile_libraries_cmake.append('opencv_calib3d460')
+spatialnde2_compile_libraries_cmake.append('opencv_imgproc460')
 
 while spatialnde2_compile_libraries_cmake.count("hdf5-shared") > 0:
     spatialnde2_compile_libraries_cmake[spatialnde2_compile_libraries_cmake.index("hdf5-shared")] = "hdf5"
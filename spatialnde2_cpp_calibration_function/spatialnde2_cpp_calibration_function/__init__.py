@@ -1 +1,2 @@
-from .calibration_function import calibration_function
+from .calibration_function import calibration_function, bgr_calibration_function
+from .calibration_function import set_calibration_threads, get_calibration_threads
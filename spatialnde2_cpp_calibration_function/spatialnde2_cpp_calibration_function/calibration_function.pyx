@@ -9,6 +9,8 @@ import spatialnde2 as snde
 
 
 from calibration_function_cpp cimport calibration_function as calibration_function_cpp
+from calibration_function_cpp cimport bgr_calibration_function as bgr_calibration_function_cpp
+from calibration_function_cpp cimport set_calibration_function_threads, get_calibration_function_threads
 
 # scalar_multiply_function_cpp is a shared_ptr to an
 # snde::math_function To make it accessible to general python, we need
@@ -23,6 +25,19 @@ from calibration_function_cpp cimport calibration_function as calibration_functi
 
 calibration_function = snde.math_function.from_raw_shared_ptr(<uintptr_t>&calibration_function_cpp)
 
+# Fused BGR -> undistorted 16 bit gray (and optionally RGBA, with a second
+# result channel) for raw OpenCVCamera frames
+bgr_calibration_function = snde.math_function.from_raw_shared_ptr(<uintptr_t>&bgr_calibration_function_cpp)
+
+
+# Maximum number of CPU cores calibration_function asks the recdb scheduler
+# for. Each execution splits the output into one row band per assigned core.
+def set_calibration_threads(unsigned nthreads):
+    set_calibration_function_threads(nthreads)
+
+def get_calibration_threads():
+    return get_calibration_function_threads()
+
 
 
 ### As an alternative to defining/registering the math function
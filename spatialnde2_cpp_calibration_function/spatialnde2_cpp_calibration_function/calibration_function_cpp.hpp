@@ -4,56 +4,473 @@
 #include "snde/snde_error.hpp"
 #include "snde/recmath_cppfunction.hpp"
 
+#include <atomic>
+#include <cstring>
+#include <exception>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <set>
+#include <string>
+#include <vector>
+
 #include <opencv2/opencv.hpp>
 
 
 
 namespace snde2_fn_ex {
 
-    
+    int cvtypefromtypenum(unsigned typenum) {
+        switch (typenum) {
+        case SNDE_RTN_UINT8:
+            return CV_8U;
+        case SNDE_RTN_INT8:
+            return CV_8S;
+        case SNDE_RTN_UINT16:
+            return CV_16U;
+        case SNDE_RTN_INT16:
+            return CV_16S;
+        case SNDE_RTN_INT32:
+            return CV_32S;
+        case SNDE_RTN_FLOAT16:
+            return CV_16F;
+        case SNDE_RTN_FLOAT32:
+            return CV_32F;
+        case SNDE_RTN_FLOAT64:
+            return CV_64F;
+        default:
+            throw snde::snde_error("calibration_function_cpp::cvtypefromtypenum -- Unknown type");
+        }
+    }
+
+
+    // A cv::Mat header can point straight at the recording storage
+    // as long as each row (last index) is contiguous in memory
+    bool cvmatcanwrap(const snde::arraylayout &layout) {
+        return layout.dimlen.size() == 2 && layout.strides[1] == 1 && layout.strides[0] >= layout.dimlen[1];
+    }
+
+
+    // Returns a cv::Mat over a 2D array of a recording, indexed (dimlen[0], dimlen[1]).
+    // When the layout allows it this is a header wrapping the recording storage
+    // (no copy, and writes go to the recording).  Otherwise the array is
+    // gathered into a new cv::Mat with a single strided pass.
     template<typename T>
-    cv::Mat copyparamstocvmat(std::shared_ptr<snde::multi_ndarray_recording> rec, snde_index arr) {
-        if(rec->layouts.at(arr).dimlen.size() == 2) {
-            size_t w = rec->layouts.at(arr).dimlen[0];
-            size_t h = rec->layouts.at(arr).dimlen[1];
-
-            int type = 0;
-            if (rec->ndinfo(arr)->typenum == SNDE_RTN_FLOAT32) {
-                type = CV_32F;
+    cv::Mat cvmatfromrecording(std::shared_ptr<snde::multi_ndarray_recording> rec, snde_index arr) {
+        const snde::arraylayout &layout = rec->layouts.at(arr);
+        if (layout.dimlen.size() != 2) {
+            throw snde::snde_error("calibration_function_cpp::cvmatfromrecording -- Only works on 2D recordings");
+        }
+        if (rec->ndinfo(arr)->elementsize != sizeof(T)) {
+            throw snde::snde_error("calibration_function_cpp::cvmatfromrecording -- Element size mismatch");
+        }
+
+        int type = cvtypefromtypenum(rec->ndinfo(arr)->typenum);
+        int rows = (int)layout.dimlen[0];
+        int cols = (int)layout.dimlen[1];
+        T *base = (T*)rec->void_shifted_arrayptr(arr);
+
+        if (cvmatcanwrap(layout)) {
+            return cv::Mat(rows, cols, type, base, layout.strides[0] * sizeof(T));
+        }
+
+        cv::Mat retval(rows, cols, type);
+        if (layout.strides[0] == 1 && layout.strides[1] >= layout.dimlen[0]) {
+            // Fortran order: wrap as the transpose and let OpenCV do a blocked transpose
+            cv::Mat transposed(cols, rows, type, base, layout.strides[1] * sizeof(T));
+            cv::transpose(transposed, retval);
+        }
+        else {
+            for (int i = 0; i < rows; i++) {
+                T *dst = retval.ptr<T>(i);
+                T *src = base + i * layout.strides[0];
+                for (int j = 0; j < cols; j++) {
+                    dst[j] = src[j * layout.strides[1]];
+                }
             }
-            else if (rec->ndinfo(arr)->typenum == SNDE_RTN_UINT16) {
-                type = CV_16U;
+        }
+        return retval;
+    }
+
+    template<typename T>
+    cv::Mat cvmatfromrecording(std::shared_ptr<snde::multi_ndarray_recording> rec, std::string arrname) {
+          snde_index arr = rec->name_mapping.at(arrname);
+          return cvmatfromrecording<T>(rec, arr);
+    }
+
+
+    // Scatters a cv::Mat into a 2D recording array whose layout could
+    // not be wrapped by cvmatfromrecording()
+    template<typename T>
+    void cvmattorecording(const cv::Mat &src, std::shared_ptr<snde::multi_ndarray_recording> rec, snde_index arr) {
+        const snde::arraylayout &layout = rec->layouts.at(arr);
+        T *base = (T*)rec->void_shifted_arrayptr(arr);
+
+        for (int i = 0; i < src.rows; i++) {
+            const T *srcrow = src.ptr<T>(i);
+            T *dst = base + i * layout.strides[0];
+            for (int j = 0; j < src.cols; j++) {
+                dst[j * layout.strides[1]] = srcrow[j];
             }
-            else if (rec->ndinfo(arr)->typenum == SNDE_RTN_UINT8) {
-                type = CV_8U;
+        }
+    }
+
+
+    // The distortion coefficients are published as either a 1D array (defaults)
+    // or a 1xN array (from cv::calibrateCamera), so just take the flattened length
+    cv::Mat copydistcoeffstocvmat(std::shared_ptr<snde::multi_ndarray_recording> rec, std::string arrname) {
+        snde_index arr = rec->name_mapping.at(arrname);
+        if (rec->ndinfo(arr)->typenum != SNDE_RTN_FLOAT32) {
+            throw snde::snde_error("calibration_function_cpp::copydistcoeffstocvmat -- Distortion coefficients must be float32");
+        }
+        size_t n = rec->layouts.at(arr).flattened_length();
+        cv::Mat retval(1, (int)n, CV_32F);
+        memcpy(retval.ptr<snde_float32>(0), rec->void_shifted_arrayptr(arr), n * sizeof(snde_float32));
+        return retval;
+    }
+
+
+    // Returns a float32 copy of a 2D array of any element type
+    cv::Mat cvmatfloat32fromrecording(std::shared_ptr<snde::multi_ndarray_recording> rec, std::string arrname) {
+        snde_index arr = rec->name_mapping.at(arrname);
+        cv::Mat src;
+
+        // Only the element size matters to cvmatfromrecording(); the OpenCV type comes from the typenum
+        switch (rec->ndinfo(arr)->elementsize) {
+        case 1:
+            src = cvmatfromrecording<uint8_t>(rec, arr);
+            break;
+        case 2:
+            src = cvmatfromrecording<uint16_t>(rec, arr);
+            break;
+        case 4:
+            src = cvmatfromrecording<uint32_t>(rec, arr);
+            break;
+        case 8:
+            src = cvmatfromrecording<uint64_t>(rec, arr);
+            break;
+        default:
+            throw snde::snde_error("calibration_function_cpp::cvmatfloat32fromrecording -- Unknown element size");
+        }
+
+        cv::Mat retval;
+        src.convertTo(retval, CV_32F);
+        return retval;
+    }
+
+
+    // Returns a CV_8UC3 cv::Mat over a (rows, cols, 3) uint8 BGR frame such as
+    // OpenCVCamera publishes.  Wraps the recording storage when each pixel's
+    // channels and each row are contiguous, otherwise gathers a copy.
+    cv::Mat cvmatfrombgrrecording(std::shared_ptr<snde::multi_ndarray_recording> rec, snde_index arr) {
+        const snde::arraylayout &layout = rec->layouts.at(arr);
+        if (rec->ndinfo(arr)->typenum != SNDE_RTN_UINT8 || layout.dimlen.size() != 3 || layout.dimlen[2] != 3) {
+            throw snde::snde_error("calibration_function_cpp::cvmatfrombgrrecording -- Only works on (rows, cols, 3) uint8 recordings");
+        }
+
+        int rows = (int)layout.dimlen[0];
+        int cols = (int)layout.dimlen[1];
+        uint8_t *base = (uint8_t*)rec->void_shifted_arrayptr(arr);
+
+        if (layout.strides[2] == 1 && layout.strides[1] == 3 && layout.strides[0] >= 3 * layout.dimlen[1]) {
+            return cv::Mat(rows, cols, CV_8UC3, base, layout.strides[0]);
+        }
+
+        cv::Mat retval(rows, cols, CV_8UC3);
+        for (int i = 0; i < rows; i++) {
+            uint8_t *dst = retval.ptr<uint8_t>(i);
+            for (int j = 0; j < cols; j++) {
+                for (int k = 0; k < 3; k++) {
+                    dst[3 * j + k] = base[i * layout.strides[0] + j * layout.strides[1] + k * layout.strides[2]];
+                }
             }
-            else {
-                throw snde::snde_error("calibration_function_cpp::copyparamstocvmat -- Unknown type");
+        }
+        return retval;
+    }
+
+
+    // Returns a bright/dark field as a CV_32F gray image, or an empty cv::Mat
+    // if its layout is not usable.  Fields captured from a 2D channel are
+    // used as is.  Fields captured from the raw (rows, cols, 3) uint8 BGR
+    // camera channel are converted to 16 bit gray the way
+    // numpy_bgrtogray16 and bgr_calibration_function convert frames.
+    cv::Mat flatfieldfromrecording(std::shared_ptr<snde::multi_ndarray_recording> calibrec, std::string arrname) {
+        snde_index arr = calibrec->name_mapping.at(arrname);
+        const snde::arraylayout &layout = calibrec->layouts.at(arr);
+
+        if (layout.dimlen.size() == 2) {
+            return cvmatfloat32fromrecording(calibrec, arrname);
+        }
+        if (layout.dimlen.size() == 3 && layout.dimlen[2] == 3 && calibrec->ndinfo(arr)->typenum == SNDE_RTN_UINT8) {
+            cv::Mat bgrf;
+            cv::Mat grayf;
+            cvmatfrombgrrecording(calibrec, arr).convertTo(bgrf, CV_32F, 256.0);
+            cv::cvtColor(bgrf, grayf, cv::COLOR_BGR2GRAY);
+            return grayf;
+        }
+        return cv::Mat();
+    }
+
+
+    // Undistortion maps from cv::initUndistortRectifyMap for one revision
+    // of a calibration recording and one frame shape
+    struct undistort_maps {
+        std::weak_ptr<snde::multi_ndarray_recording> calibrec;
+        std::string calib_channel;
+        uint64_t calib_revision;
+        int rows;
+        int cols;
+        cv::Mat map1; // CV_16SC2 fixed-point source coordinates
+        cv::Mat map2; // CV_16UC1 interpolation table indices
+
+        // Flat field correction, only when the brightfield and darkfield
+        // match the frame shape.  Both are already remapped to the
+        // undistorted (output) coordinates so they can be applied after
+        // cv::remap without another pass over the input frame.
+        bool flatfield;
+        cv::Mat dark; // CV_32F darkfield
+        cv::Mat gain; // CV_32F mean(bright - dark) / (bright - dark), zero for dead pixels
+    };
+
+
+    // Rebuilding the maps costs far more than applying them, so they are
+    // cached per calibration recording and frame shape, and only recomputed
+    // when a new calibration recording is published or the frame shape
+    // changes.  Entries are matched on the calibration recording itself
+    // (not its address), are dropped as soon as that recording is freed,
+    // and at most max_entries of them are kept, least recently used first
+    // out.  Math functions sharing a calibration share its maps.
+    class undistort_map_cache {
+    public:
+        std::mutex admin; // protects maps
+        std::list<std::shared_ptr<undistort_maps>> maps; // most recently used first
+        size_t max_entries;
+
+        undistort_map_cache(size_t max_entries) :
+            max_entries(max_entries)
+        {
+
+        }
+
+        std::shared_ptr<undistort_maps> get(std::shared_ptr<snde::multi_ndarray_recording> calibrec, int rows, int cols) {
+            std::string calib_channel = calibrec->info->name;
+            uint64_t calib_revision = calibrec->info->revision;
+
+            {
+                std::lock_guard<std::mutex> lock(admin);
+                for (auto maps_it = maps.begin(); maps_it != maps.end(); ) {
+                    std::shared_ptr<undistort_maps> cached = *maps_it;
+                    std::shared_ptr<snde::multi_ndarray_recording> cachedrec = cached->calibrec.lock();
+                    if (!cachedrec) {
+                        // Calibration recording is gone; nothing can match this entry again
+                        maps_it = maps.erase(maps_it);
+                        continue;
+                    }
+                    if (cachedrec == calibrec && cached->rows == rows && cached->cols == cols) {
+                        maps.splice(maps.begin(), maps, maps_it);
+                        return cached;
+                    }
+                    ++maps_it;
+                }
+            }
+
+            // Build outside the lock so other functions are not held up
+            std::shared_ptr<undistort_maps> newmaps = std::make_shared<undistort_maps>();
+            newmaps->calibrec = calibrec;
+            newmaps->calib_channel = calib_channel;
+            newmaps->calib_revision = calib_revision;
+            newmaps->rows = rows;
+            newmaps->cols = cols;
+
+            cv::Mat mtx = cvmatfromrecording<snde_float32>(calibrec, "cam_mtx");
+            cv::Mat newmtx = cvmatfromrecording<snde_float32>(calibrec, "cam_newmtx");
+            cv::Mat dist = copydistcoeffstocvmat(calibrec, "cam_dist");
+
+            cv::initUndistortRectifyMap(mtx, dist, cv::Mat(), newmtx, cv::Size(cols, rows), CV_16SC2, newmaps->map1, newmaps->map2);
+
+            cv::Mat bright = flatfieldfromrecording(calibrec, "brightfield");
+            cv::Mat dark = flatfieldfromrecording(calibrec, "darkfield");
+            newmaps->flatfield = (bright.rows == rows && bright.cols == cols && dark.rows == rows && dark.cols == cols);
+            if (newmaps->flatfield) {
+
+                // Normalizing by the mean flat level keeps integer outputs in range
+                cv::Mat response = bright - dark;
+                cv::Mat valid = response > 0;
+                if (cv::countNonZero(valid) == 0) {
+                    // e.g. brightfield and darkfield captured the wrong way around;
+                    // an all zero gain would turn every frame black
+                    snde::snde_warning("calibration_function_cpp: brightfield is nowhere brighter than darkfield in %s revision %llu -- skipping flat field correction", calib_channel.c_str(), (unsigned long long)calib_revision);
+                    newmaps->flatfield = false;
+                }
+                else {
+                    double meanresponse = cv::mean(response, valid)[0];
+                    cv::Mat gain = cv::Mat::zeros(rows, cols, CV_32F);
+                    cv::divide(meanresponse, response, gain);
+                    gain.setTo(0, ~valid);
+
+                    cv::remap(dark, newmaps->dark, newmaps->map1, newmaps->map2, cv::INTER_LINEAR, cv::BORDER_CONSTANT);
+                    cv::remap(gain, newmaps->gain, newmaps->map1, newmaps->map2, cv::INTER_LINEAR, cv::BORDER_CONSTANT);
+                }
+            }
+
+            std::lock_guard<std::mutex> lock(admin);
+            maps.push_front(newmaps);
+            while (maps.size() > max_entries) {
+                maps.pop_back();
             }
+            return newmaps;
+        }
+    };
+
+    // Each entry holds about 14 bytes per pixel (over 100 MB at 4K)
+    static undistort_map_cache undistort_cache(4);
+
 
+    // Upper limit on the CPU cores calibration_function requests from the
+    // recdb scheduler.  The function runs on however many of those cores
+    // it is actually assigned, one row band per core (see runinbands()).
+    static std::atomic<unsigned> calibration_function_threads(1);
+
+    void set_calibration_function_threads(unsigned nthreads) {
+        if (nthreads < 1) {
+            throw snde::snde_error("calibration_function_cpp::set_calibration_function_threads -- Need at least one thread");
+        }
+        calibration_function_threads = nthreads;
+    }
 
-            cv::Mat retval(w, h, type);
+    unsigned get_calibration_function_threads() {
+        return calibration_function_threads;
+    }
+
+    // The cores to report to the scheduler for a frame of nrows rows: no
+    // more than runinbands() can use, which is limited by the row count
+    // and the size of OpenCV's thread pool
+    unsigned requestedcores(snde_index nrows) {
+        unsigned ncores = calibration_function_threads;
+        int poolsize = cv::getNumThreads();
+        if (poolsize >= 1 && (unsigned)poolsize < ncores) {
+            ncores = poolsize;
+        }
+        if (nrows < ncores) {
+            ncores = (unsigned)nrows;
+        }
+        if (ncores < 1) {
+            ncores = 1;
+        }
+        return ncores;
+    }
 
-            for (size_t i = 0; i < w; i++) {
-                for (size_t j = 0; j < h; j++) {
-                    retval.at<T>(i, j) = *(T*)rec->element_dataptr(arr, { i,j });
+
+    // Splits rows [0, nrows) into up to nbands contiguous bands and calls
+    // func(row0, row1) for each on OpenCV's own thread pool.  Running the
+    // bands inside cv::parallel_for_ engages OpenCV's nested parallelism
+    // guard, so the cv:: calls within a band stay on that band's thread
+    // and at most nbands cores are used -- a single band runs entirely on
+    // the calling thread.  (If another thread holds the pool at the time,
+    // the guard runs the bands one after another on the calling thread.)
+    // Exceptions are passed back to the caller.
+    template<typename F>
+    void runinbands(int nrows, size_t nbands, F func) {
+        if (nrows <= 0) {
+            return;
+        }
+        if (nbands > (size_t)nrows) {
+            nbands = nrows;
+        }
+        if (nbands < 1) {
+            nbands = 1;
+        }
+
+        auto bandstart = [nrows, nbands](size_t band) {
+            return (int)(((size_t)nrows * band) / nbands);
+        };
+
+        std::vector<std::exception_ptr> errors(nbands);
+        cv::parallel_for_(cv::Range(0, (int)nbands), [&func, &errors, bandstart](const cv::Range &bands) {
+            for (int band = bands.start; band < bands.end; band++) {
+                try {
+                    func(bandstart(band), bandstart(band + 1));
+                }
+                catch (...) {
+                    errors[band] = std::current_exception();
                 }
             }
+        }, (double)nbands);
+        for (auto &error : errors) {
+            if (error) {
+                std::rethrow_exception(error);
+            }
+        }
+    }
 
-            return retval;
 
+    // Valid pixel region from cv::getOptimalNewCameraMatrix (x, y, width, height)
+    // clipped to the frame.  OpenCVCalibration publishes (0, 0, -1, -1) by
+    // default, which selects the whole frame.
+    cv::Rect calibroi(std::shared_ptr<snde::multi_ndarray_recording> calibrec, int rows, int cols) {
+        snde_index arr = calibrec->name_mapping.at("cam_roi");
+        cv::Rect full(0, 0, cols, rows);
+
+        if (calibrec->ndinfo(arr)->typenum != SNDE_RTN_INT32 || calibrec->layouts.at(arr).flattened_length() != 4) {
+            throw snde::snde_error("calibration_function_cpp::calibroi -- cam_roi must be 4 int32 values");
         }
-        else {
-            throw snde::snde_error("calibration_function_cpp::copyparamstocvmat -- Only works on 2D recordings");
+        int32_t *roi = (int32_t*)calibrec->void_shifted_arrayptr(arr);
+
+        cv::Rect rect = cv::Rect(roi[0], roi[1], roi[2], roi[3]) & full;
+        if (rect.area() <= 0) {
+            return full;
         }
+        return rect;
+    }
 
-      
+
+    // Metadata for an output of recording remapped into outroi: the input's
+    // metadata, with the axis offsets shifted so coordinates of a cropped
+    // image still match the full frame
+    std::shared_ptr<snde::constructible_metadata> roimetadata(std::shared_ptr<snde::multi_ndarray_recording> recording, const cv::Rect &outroi) {
+        std::shared_ptr<snde::constructible_metadata> metadata = std::make_shared<snde::constructible_metadata>();
+        if (outroi.x != 0 || outroi.y != 0) {
+            std::pair<double, std::string> axis0_offset = recording->metadata->GetMetaDatumDblUnits("ande_array-axis0_offset", 0.0, "pixels");
+            std::pair<double, std::string> axis0_scale = recording->metadata->GetMetaDatumDblUnits("ande_array-axis0_scale", 1.0, "pixels");
+            std::pair<double, std::string> axis1_offset = recording->metadata->GetMetaDatumDblUnits("ande_array-axis1_offset", 0.0, "pixels");
+            std::pair<double, std::string> axis1_scale = recording->metadata->GetMetaDatumDblUnits("ande_array-axis1_scale", 1.0, "pixels");
+            metadata->AddMetaDatum(snde::metadatum_dblunits("ande_array-axis0_offset", axis0_offset.first + outroi.y * axis0_scale.first, axis0_offset.second));
+            metadata->AddMetaDatum(snde::metadatum_dblunits("ande_array-axis1_offset", axis1_offset.first + outroi.x * axis1_scale.first, axis1_offset.second));
+        }
+        return snde::MergeMetadata(recording->metadata, metadata);
     }
 
-    template<typename T>
-    cv::Mat copyparamstocvmat(std::shared_ptr<snde::multi_ndarray_recording> rec, std::string arrname) {
-          snde_index arr = rec->name_mapping.at(arrname);
-          return copyparamstocvmat<T>(rec, arr);
+
+    // Locks array 0 of each output for writing and every array of the
+    // frame and calibration recordings for reading.  Locking is only
+    // required for recordings with special storage under certain
+    // conditions, but it is always good to explicitly request the locks,
+    // as the locking is a no-op if it is not actually required.
+    snde::rwlock_token_set lockcalibrationarrays(std::shared_ptr<snde::lockmanager> lockmgr, const std::vector<std::shared_ptr<snde::multi_ndarray_recording>> &outputs, std::shared_ptr<snde::multi_ndarray_recording> recording, std::shared_ptr<snde::multi_ndarray_recording> calibrec) {
+        std::vector<std::pair<std::shared_ptr<snde::multi_ndarray_recording>, std::pair<size_t, bool>>> recrefs_to_lock;
+
+        for (auto &output : outputs) {
+            recrefs_to_lock.emplace_back(std::make_pair(output, std::make_pair(0, true)));
+        }
+        for (snde_index arraynum = 0; arraynum < recording->mndinfo()->num_arrays; arraynum++) {
+            recrefs_to_lock.emplace_back(std::make_pair(recording, std::make_pair(arraynum, false)));
+        }
+        for (snde_index arraynum = 0; arraynum < calibrec->mndinfo()->num_arrays; arraynum++) {
+            recrefs_to_lock.emplace_back(std::make_pair(calibrec, std::make_pair(arraynum, false)));
+        }
+
+        return lockmgr->lock_recording_arrays(recrefs_to_lock, false);
+    }
+
+
+    // Number of CPU cores the scheduler assigned to this execution, i.e.
+    // the number of row bands to split the output into
+    size_t assignedcores(std::shared_ptr<snde::assigned_compute_resource> compute_resource) {
+        std::shared_ptr<snde::assigned_compute_resource_cpu> cpu = std::dynamic_pointer_cast<snde::assigned_compute_resource_cpu>(compute_resource);
+        if (cpu && cpu->assigned_cpu_core_indices.size() > 1) {
+            return cpu->assigned_cpu_core_indices.size();
+        }
+        return 1;
     }
 
 
@@ -71,11 +488,28 @@ namespace snde2_fn_ex {
     
     // These typedefs are regrettably necessary and will need to be updated according to the parameter signature of your function
     // https://stackoverflow.com/questions/1120833/derived-template-class-access-to-base-class-member-data
+    typedef typename snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>::define_recs_function_override_type define_recs_function_override_type;
     typedef typename snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>::metadata_function_override_type metadata_function_override_type;
     typedef typename snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>::lock_alloc_function_override_type lock_alloc_function_override_type;
     typedef typename snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>::exec_function_override_type exec_function_override_type;
 
-    // just using the default for decide_new_revision and compute_options
+    // just using the default for decide_new_revision
+
+    std::pair<std::vector<std::shared_ptr<snde::compute_resource_option>>,std::shared_ptr<define_recs_function_override_type>> compute_options(std::shared_ptr<snde::multi_ndarray_recording> recording, std::shared_ptr<snde::multi_ndarray_recording> calibrec, snde_bool crop)
+    {
+      // Tell the scheduler how many cores the banded remap can use
+      snde_index numpixels = recording->layouts.at(0).flattened_length();
+      snde_index nrows = recording->layouts.at(0).dimlen.size() > 0 ? recording->layouts.at(0).dimlen[0] : 1;
+      std::vector<std::shared_ptr<snde::compute_resource_option>> option_list = {
+        std::make_shared<snde::compute_resource_option_cpu>(std::set<std::string>(), // no execution tags
+                                                            0, // metadata_bytes
+                                                            2 * numpixels * sizeof(T), // data_bytes for transfer
+                                                            20.0 * numpixels, // flops (bilinear interpolation)
+                                                            requestedcores(nrows), // max effective cpu cores
+                                                            1), // useful_cpu_cores (min # of cores to supply)
+      };
+      return std::make_pair(option_list, nullptr);
+    }
     
     std::shared_ptr<metadata_function_override_type> define_recs(std::shared_ptr<snde::multi_ndarray_recording> recording, std::shared_ptr<snde::multi_ndarray_recording> calibrec, snde_bool crop)
     {
@@ -85,63 +519,79 @@ namespace snde2_fn_ex {
       std::shared_ptr<snde::multi_ndarray_recording> result_rec = snde::create_recording_math<snde::multi_ndarray_recording>(this->get_result_channel_path(0),this->rss,1);
       result_rec->define_array(0, recording->ndinfo(0)->typenum, "calibimg");
       // ***!!! Should provide means to set allocation manager !!!***
+
+      if (recording->layouts.at(0).dimlen.size() != 2) {
+        throw snde::snde_error("calibration_function_cpp::define_recs -- Only works on 2D recordings");
+      }
+      int rows = (int)recording->layouts.at(0).dimlen[0];
+      int cols = (int)recording->layouts.at(0).dimlen[1];
+
+      // With crop, only the valid region is remapped and the output is allocated at that size
+      cv::Rect outroi(0, 0, cols, rows);
+      if (crop) {
+        outroi = calibroi(calibrec, rows, cols);
+      }
       
-      return std::make_shared<metadata_function_override_type>([ this,result_rec,recording,calibrec,crop]() {
+      return std::make_shared<metadata_function_override_type>([ this,result_rec,recording,calibrec,crop,outroi]() {
 	// metadata code
 	snde::snde_debug(SNDE_DC_APP,"metadata()");
 	
 
-    std::shared_ptr<snde::constructible_metadata> metadata;
-    result_rec->metadata = snde::MergeMetadata(metadata, recording->metadata);
+    result_rec->metadata = roimetadata(recording, outroi);
 	result_rec->mark_metadata_done();
 	
-	return std::make_shared<lock_alloc_function_override_type>([ this,result_rec,recording,calibrec,crop]() {
+	return std::make_shared<lock_alloc_function_override_type>([ this,result_rec,recording,calibrec,crop,outroi]() {
 	  // lock_alloc code
 	  
-	  result_rec->allocate_storage(0, recording->layouts.at(0).dimlen);
-
-	  // locking is only required for certain recordings
-	  // with special storage under certain conditions,
-	  // however it is always good to explicitly request
-	  // the locks, as the locking is a no-op if
-	  // locking is not actually required.
-    std::vector<std::pair<std::shared_ptr<snde::multi_ndarray_recording>, std::pair<size_t, bool>>> recrefs_to_lock = {
-					  { result_rec, { 0, true } }, // colorimage
-					};
-
-    for (snde_index arraynum = 0; arraynum < recording->mndinfo()->num_arrays; arraynum++) {
-						recrefs_to_lock.emplace_back(std::make_pair(recording, std::make_pair(arraynum, false)));
-					}
-
-    for (snde_index arraynum = 0; arraynum < calibrec->mndinfo()->num_arrays; arraynum++) {
-						recrefs_to_lock.emplace_back(std::make_pair(calibrec, std::make_pair(arraynum, false)));
-					}
-
-    snde::rwlock_token_set locktokens = this->lockmgr->lock_recording_arrays(recrefs_to_lock, false);
+	  result_rec->allocate_storage(0, { (snde_index)outroi.height, (snde_index)outroi.width });
+
+    snde::rwlock_token_set locktokens = lockcalibrationarrays(this->lockmgr, { result_rec }, recording, calibrec);
     
 	  
 
 	  
-	  return std::make_shared<exec_function_override_type>([ this,locktokens,result_rec,recording,calibrec,crop]() {
+	  return std::make_shared<exec_function_override_type>([ this,locktokens,result_rec,recording,calibrec,crop,outroi]() {
 	    // exec code
 	    
-      cv::Mat mtx = copyparamstocvmat<snde_float32>(calibrec, "cam_mtx");
-      cv::Vec<snde_float32, 14> dist((snde_float32*)calibrec->void_shifted_arrayptr("cam_dist"));
+      cv::Mat cvin = cvmatfromrecording<T>(recording, 0);
 
-      cv::Mat newmtx = copyparamstocvmat<snde_float32>(calibrec, "cam_newmtx");
-      cv::Mat cvin = copyparamstocvmat<T>(recording, 0);
-      
+      // remap() writes straight into the allocated calibimg storage
+      // whenever a cv::Mat header can wrap it
+      bool outwrapped = cvmatcanwrap(result_rec->layouts.at(0));
       cv::Mat cvout;
+      if (outwrapped) {
+        cvout = cvmatfromrecording<T>(result_rec, 0);
+      }
+      else {
+        cvout.create(outroi.height, outroi.width, cvin.type());
+      }
 
-      size_t w = result_rec->layouts.at(0).dimlen[0];
-      size_t h = result_rec->layouts.at(0).dimlen[1];
-      
-      cv::undistort(cvin, cvout, mtx, dist, newmtx);
+      std::shared_ptr<undistort_maps> maps = undistort_cache.get(calibrec, cvin.rows, cvin.cols);
+
+      // One row band of the output per CPU core the scheduler assigned us
+      size_t nthreads = assignedcores(this->compute_resource);
 
-      for (size_t i=0; i < w; i++) {
-        for (size_t j=0; j< h; j++) {
-          *(T*)result_rec->element_dataptr(0, {i,j}) = cvout.at<T>(i,j);
+      runinbands(outroi.height, nthreads, [&cvin, &cvout, &maps, &outroi](int row0, int row1) {
+        cv::Rect bandroi(outroi.x, outroi.y + row0, outroi.width, row1 - row0);
+        cv::Mat bandout = cvout.rowRange(row0, row1);
+
+        // Same interpolation and border handling as cv::undistort.  The maps
+        // hold absolute source coordinates, so remapping through a ROI of
+        // the maps produces just that region of the output (crop or band).
+        cv::remap(cvin, bandout, maps->map1(bandroi), maps->map2(bandroi), cv::INTER_LINEAR, cv::BORDER_CONSTANT);
+
+        if (maps->flatfield) {
+          // (img - dark) * gain on the undistorted band while it is still in cache; convertTo() saturates back to T
+          cv::Mat corrected;
+          bandout.convertTo(corrected, CV_32F);
+          cv::subtract(corrected, maps->dark(bandroi), corrected);
+          cv::multiply(corrected, maps->gain(bandroi), corrected);
+          corrected.convertTo(bandout, bandout.type());
         }
+      });
+
+      if (!outwrapped) {
+        cvmattorecording<T>(cvout, result_rec, 0);
       }
       
       
@@ -163,6 +613,182 @@ namespace snde2_fn_ex {
   };
 
 
+
+
+  // Fused alternative to numpy_bgrtogray16 followed by calibration_function
+  // for BGR frames straight from OpenCVCamera: each row band of the frame is
+  // remapped once, in color, and converted to 16 bit grayscale (scaled by
+  // 256 like numpy_bgrtogray16) with flat field correction while still in
+  // cache, so the full frame is only read once and the intermediate gray
+  // recording is never allocated.  If the function is instantiated with a
+  // second result channel, the undistorted frame is also written there as RGBA.
+  // Bright/dark fields captured from the raw BGR channel are converted to
+  // gray16 when the maps are built (see flatfieldfromrecording()).
+  class bgr_camera_calibration: public snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>
+  {
+  public:
+      bgr_camera_calibration(std::shared_ptr<snde::recording_set_state> rss,std::shared_ptr<snde::instantiated_math_function> inst) :
+      snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>(rss,inst)
+    {
+      
+    }
+    
+    typedef typename snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>::define_recs_function_override_type define_recs_function_override_type;
+    typedef typename snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>::metadata_function_override_type metadata_function_override_type;
+    typedef typename snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>::lock_alloc_function_override_type lock_alloc_function_override_type;
+    typedef typename snde::recmath_cppfuncexec<std::shared_ptr<snde::multi_ndarray_recording>,std::shared_ptr<snde::multi_ndarray_recording>,snde_bool>::exec_function_override_type exec_function_override_type;
+
+    // just using the default for decide_new_revision
+
+    std::pair<std::vector<std::shared_ptr<snde::compute_resource_option>>,std::shared_ptr<define_recs_function_override_type>> compute_options(std::shared_ptr<snde::multi_ndarray_recording> recording, std::shared_ptr<snde::multi_ndarray_recording> calibrec, snde_bool crop)
+    {
+      snde_index numpixels = recording->layouts.at(0).flattened_length() / 3;
+      snde_index nrows = recording->layouts.at(0).dimlen.size() > 0 ? recording->layouts.at(0).dimlen[0] : 1;
+      // BGR in and gray out, plus RGBA out only if there is a second result channel
+      snde_index pixelbytes = 3 + sizeof(uint16_t);
+      if (this->inst->result_channel_paths.size() > 1) {
+        pixelbytes += sizeof(snde_rgba);
+      }
+      std::vector<std::shared_ptr<snde::compute_resource_option>> option_list = {
+        std::make_shared<snde::compute_resource_option_cpu>(std::set<std::string>(), // no execution tags
+                                                            0, // metadata_bytes
+                                                            numpixels * pixelbytes, // data_bytes for transfer
+                                                            40.0 * numpixels, // flops (3 channel bilinear interpolation and color conversion)
+                                                            requestedcores(nrows), // max effective cpu cores
+                                                            1), // useful_cpu_cores (min # of cores to supply)
+      };
+      return std::make_pair(option_list, nullptr);
+    }
+    
+    std::shared_ptr<metadata_function_override_type> define_recs(std::shared_ptr<snde::multi_ndarray_recording> recording, std::shared_ptr<snde::multi_ndarray_recording> calibrec, snde_bool crop)
+    {
+      snde::snde_debug(SNDE_DC_APP,"define_recs()");
+
+      const snde::arraylayout &layout = recording->layouts.at(0);
+      if (recording->ndinfo(0)->typenum != SNDE_RTN_UINT8 || layout.dimlen.size() != 3 || layout.dimlen[2] != 3) {
+        throw snde::snde_error("calibration_function_cpp::bgr_camera_calibration -- Only works on (rows, cols, 3) uint8 BGR recordings");
+      }
+      int rows = (int)layout.dimlen[0];
+      int cols = (int)layout.dimlen[1];
+
+      std::shared_ptr<snde::multi_ndarray_recording> result_rec = snde::create_recording_math<snde::multi_ndarray_recording>(this->get_result_channel_path(0),this->rss,1);
+      result_rec->define_array(0, SNDE_RTN_UINT16, "calibimg");
+
+      std::shared_ptr<snde::multi_ndarray_recording> rgba_rec;
+      if (this->inst->result_channel_paths.size() > 1) {
+        rgba_rec = snde::create_recording_math<snde::multi_ndarray_recording>(this->get_result_channel_path(1),this->rss,1);
+        rgba_rec->define_array(0, SNDE_RTN_SNDE_RGBA, "calibrgba");
+      }
+
+      cv::Rect outroi(0, 0, cols, rows);
+      if (crop) {
+        outroi = calibroi(calibrec, rows, cols);
+      }
+      
+      return std::make_shared<metadata_function_override_type>([ this,result_rec,rgba_rec,recording,calibrec,crop,outroi]() {
+	snde::snde_debug(SNDE_DC_APP,"metadata()");
+
+    std::shared_ptr<snde::constructible_metadata> metadata = roimetadata(recording, outroi);
+    result_rec->metadata = metadata;
+	result_rec->mark_metadata_done();
+    if (rgba_rec) {
+      rgba_rec->metadata = metadata;
+      rgba_rec->mark_metadata_done();
+    }
+	
+	return std::make_shared<lock_alloc_function_override_type>([ this,result_rec,rgba_rec,recording,calibrec,crop,outroi]() {
+	  result_rec->allocate_storage(0, { (snde_index)outroi.height, (snde_index)outroi.width });
+	  if (rgba_rec) {
+	    rgba_rec->allocate_storage(0, { (snde_index)outroi.height, (snde_index)outroi.width });
+	  }
+
+    std::vector<std::shared_ptr<snde::multi_ndarray_recording>> outputs = { result_rec };
+    if (rgba_rec) {
+      outputs.push_back(rgba_rec);
+    }
+    snde::rwlock_token_set locktokens = lockcalibrationarrays(this->lockmgr, outputs, recording, calibrec);
+	  
+	  return std::make_shared<exec_function_override_type>([ this,locktokens,result_rec,rgba_rec,recording,calibrec,crop,outroi]() {
+      cv::Mat cvin = cvmatfrombgrrecording(recording, 0);
+
+      bool outwrapped = cvmatcanwrap(result_rec->layouts.at(0));
+      cv::Mat cvout;
+      if (outwrapped) {
+        cvout = cvmatfromrecording<uint16_t>(result_rec, 0);
+      }
+      else {
+        cvout.create(outroi.height, outroi.width, CV_16U);
+      }
+
+      // snde_rgba is 4 bytes r, g, b, a, i.e. CV_8UC4 in RGBA order
+      bool rgbawrapped = false;
+      cv::Mat cvrgba;
+      if (rgba_rec) {
+        const snde::arraylayout &rgbalayout = rgba_rec->layouts.at(0);
+        rgbawrapped = cvmatcanwrap(rgbalayout);
+        if (rgbawrapped) {
+          cvrgba = cv::Mat(outroi.height, outroi.width, CV_8UC4, rgba_rec->void_shifted_arrayptr(0), rgbalayout.strides[0] * sizeof(snde_rgba));
+        }
+        else {
+          cvrgba.create(outroi.height, outroi.width, CV_8UC4);
+        }
+      }
+
+      std::shared_ptr<undistort_maps> maps = undistort_cache.get(calibrec, cvin.rows, cvin.cols);
+
+      size_t nthreads = assignedcores(this->compute_resource);
+
+      bool withrgba = (bool)rgba_rec;
+      runinbands(outroi.height, nthreads, [&cvin, &cvout, &cvrgba, withrgba, &maps, &outroi](int row0, int row1) {
+        cv::Rect bandroi(outroi.x, outroi.y + row0, outroi.width, row1 - row0);
+        cv::Mat bandout = cvout.rowRange(row0, row1);
+
+        // Only this band's worth of undistorted color is ever held
+        cv::Mat bandbgr;
+        cv::remap(cvin, bandbgr, maps->map1(bandroi), maps->map2(bandroi), cv::INTER_LINEAR, cv::BORDER_CONSTANT);
+
+        if (withrgba) {
+          cv::Mat bandrgba = cvrgba.rowRange(row0, row1);
+          cv::cvtColor(bandbgr, bandrgba, cv::COLOR_BGR2RGBA);
+        }
+
+        if (maps->flatfield) {
+          // The fields are in gray16 units, so stay in float until the gain is applied
+          cv::Mat bandf;
+          cv::Mat grayf;
+          bandbgr.convertTo(bandf, CV_32F, 256.0);
+          cv::cvtColor(bandf, grayf, cv::COLOR_BGR2GRAY);
+          cv::subtract(grayf, maps->dark(bandroi), grayf);
+          cv::multiply(grayf, maps->gain(bandroi), grayf);
+          grayf.convertTo(bandout, CV_16U);
+        }
+        else {
+          cv::Mat band16;
+          bandbgr.convertTo(band16, CV_16U, 256.0);
+          cv::cvtColor(band16, bandout, cv::COLOR_BGR2GRAY);
+        }
+      });
+
+      if (!outwrapped) {
+        cvmattorecording<uint16_t>(cvout, result_rec, 0);
+      }
+      if (withrgba && !rgbawrapped) {
+        cvmattorecording<snde_rgba>(cvrgba, rgba_rec, 0);
+      }
+	    
+	    snde::unlock_rwlock_token_set(locktokens); // lock must be released prior to mark_data_ready() 
+
+	    result_rec->mark_data_ready();
+	    if (rgba_rec) {
+	      rgba_rec->mark_data_ready();
+	    }
+	  }); 
+	});
+      });
+    }
+    
+  };
+
   
   std::shared_ptr<snde::math_function> define_calibration_function()
   {
@@ -194,6 +820,21 @@ namespace snde2_fn_ex {
 
   static int registered_calibration_function = register_math_function("spatialnde2_cpp_calibration_function.calibration_function",calibration_function);
 
+
+  std::shared_ptr<snde::math_function> define_bgr_calibration_function()
+  {
+      std::shared_ptr<snde::math_function> newfunc = std::make_shared<snde::cpp_math_function>([](std::shared_ptr<snde::recording_set_state> rss, std::shared_ptr<snde::instantiated_math_function> inst) {
+          return std::make_shared<bgr_camera_calibration>(rss, inst);
+          });
+      newfunc->new_revision_optional = true;
+      return newfunc;
+  }
+
+
+  static std::shared_ptr<snde::math_function> bgr_calibration_function=define_bgr_calibration_function();
+
+  static int registered_bgr_calibration_function = register_math_function("spatialnde2_cpp_calibration_function.bgr_calibration_function",bgr_calibration_function);
+
 };
 
 #endif // SNDE_CPP_CALIBRATION_FUNCTION_HPP
@@ -6,4 +6,8 @@ from spatialnde2.recmath cimport math_function
 cdef extern from "calibration_function_cpp.hpp" namespace "snde2_fn_ex" nogil:
     cdef shared_ptr[math_function] define_calibration_function()
     cdef shared_ptr[math_function] calibration_function
+    cdef shared_ptr[math_function] define_bgr_calibration_function()
+    cdef shared_ptr[math_function] bgr_calibration_function
+    cdef void set_calibration_function_threads(unsigned nthreads) except +
+    cdef unsigned get_calibration_function_threads()
     pass
@@ -0,0 +1,124 @@
+# FrameRingBuffer is pure Python, so it is tested without a camera.  It is
+# loaded from its file because the package __init__ imports the camera
+# modules, which need spatialnde2, OpenCV and dataguzzler-python.
+import importlib.util
+import os.path
+import threading
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location("ringbuffer", os.path.join(os.path.dirname(__file__), "..", "dgpython_opencv_camera", "ringbuffer.py"))
+ringbuffer = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ringbuffer)
+
+FrameRingBuffer = ringbuffer.FrameRingBuffer
+
+
+def fill(buf):
+    # Commits a frame into every slot; returns the slots in commit order
+    slots = []
+    for cnt in range(buf.capacity):
+        slot = buf.acquire_write()
+        assert slot is not None
+        buf.commit_write(slot)
+        slots.append(slot)
+    return slots
+
+
+def test_rejects_bad_arguments():
+    with pytest.raises(ValueError):
+        FrameRingBuffer(1)
+    with pytest.raises(ValueError):
+        FrameRingBuffer(2, "drop_everything")
+
+
+def test_frames_are_read_in_order():
+    buf = FrameRingBuffer(3)
+    slots = fill(buf)
+    for slot in slots:
+        assert buf.acquire_read() == slot
+        buf.release_read(slot)
+    stats = buf.stats()
+    assert stats["GrabbedFrames"] == 3
+    assert stats["PublishedFrames"] == 3
+    assert stats["QueueDepth"] == 0
+
+
+def test_drop_oldest_reuses_oldest_queued_slot():
+    buf = FrameRingBuffer(2, ringbuffer.DROP_OLDEST)
+    slots = fill(buf)
+    assert buf.acquire_write() == slots[0]
+    assert buf.dropped == 1
+    assert buf.depth() == 1
+
+
+def test_drop_newest_discards_incoming_frame():
+    buf = FrameRingBuffer(2, ringbuffer.DROP_NEWEST)
+    slots = fill(buf)
+    assert buf.acquire_write() is None
+    assert buf.dropped == 1
+    assert buf.depth() == 2
+    assert buf.acquire_read() == slots[0]
+
+
+def test_block_waits_for_a_free_slot():
+    buf = FrameRingBuffer(2, ringbuffer.BLOCK)
+    fill(buf)
+    result = []
+    writer = threading.Thread(target=lambda: result.append(buf.acquire_write()))
+    writer.start()
+    writer.join(0.1)
+    assert writer.is_alive()
+
+    slot = buf.acquire_read()
+    buf.release_read(slot)
+    writer.join(5.0)
+    assert not writer.is_alive()
+    assert result == [slot]
+    assert buf.dropped == 0
+
+
+def test_close_write_wakes_blocked_writer():
+    buf = FrameRingBuffer(2, ringbuffer.BLOCK)
+    fill(buf)
+    result = []
+    writer = threading.Thread(target=lambda: result.append(buf.acquire_write()))
+    writer.start()
+    writer.join(0.1)
+    buf.close_write()
+    writer.join(5.0)
+    assert not writer.is_alive()
+    assert result == [None]
+
+
+def test_frame_committed_after_close_write_is_published():
+    buf = FrameRingBuffer(2)
+    slot = buf.acquire_write()
+    buf.close_write()
+    assert buf.acquire_write() is None
+
+    # The writer finishes the frame it held, then exits
+    buf.commit_write(slot)
+    buf.close()
+
+    assert buf.acquire_read() == slot
+    buf.release_read(slot)
+    assert buf.acquire_read() is None
+    stats = buf.stats()
+    assert stats["GrabbedFrames"] == stats["PublishedFrames"] == 1
+    assert stats["QueueDepth"] == 0
+
+
+def test_reader_waits_until_writer_closes():
+    buf = FrameRingBuffer(2)
+    result = []
+    reader = threading.Thread(target=lambda: result.append(buf.acquire_read()))
+    reader.start()
+    buf.close_write()
+    reader.join(0.1)
+    assert reader.is_alive()
+
+    buf.close()
+    reader.join(5.0)
+    assert not reader.is_alive()
+    assert result == [None]